@@ -1,8 +1,9 @@
+import os
 import nltk
 import logging
 import asyncio
 from indexer import Indexer
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from storage import MinimaStore
 from async_queue import AsyncQueue
 from fastapi import FastAPI, APIRouter
@@ -13,6 +14,8 @@ from async_loop import index_loop, crawl_loop
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CRAWL_INTERVAL_SECONDS = int(os.environ.get("CRAWL_INTERVAL_SECONDS", 60 * 20))
+
 indexer = Indexer()
 router = APIRouter()
 async_queue = AsyncQueue()
@@ -28,19 +31,49 @@ def init_loader_dependencies():
 
 init_loader_dependencies()
 
-class Query(BaseModel):
+class SearchFilters(BaseModel):
+    k: int | None = Field(default=None, ge=1)
+    file_type: str | None = None
+    folder: str | None = None
+    modified_after: int | None = None
+    modified_before: int | None = None
+
+
+class Query(SearchFilters):
     query: str
 
 
+class BatchQuery(SearchFilters):
+    queries: list[str]
+
+
+class DocumentsQuery(SearchFilters):
+    query: str
+    k: int = Field(default=4, ge=1)
+
+
+class FilesQuery(BaseModel):
+    paths: list[str]
+
+
+def search_filter(request: SearchFilters):
+    return indexer.build_filter(
+        file_type=request.file_type,
+        folder=request.folder,
+        modified_after=request.modified_after,
+        modified_before=request.modified_before
+    )
+
+
 @router.post(
     "/query", 
     response_description='Query local data storage',
 )
 async def query(request: Query):
-    logger.info(f"Received query: {query}")
+    logger.info(f"Received query: {request.query}")
     try:
-        result = indexer.find(request.query)
-        logger.info(f"Found {len(result)} results for query: {query}")
+        result = await indexer.find(request.query, request.k, search_filter(request))
+        logger.info(f"Found {len(result)} results for query: {request.query}")
         logger.info(f"Results: {result}")
         return {"result": result}
     except Exception as e:
@@ -55,7 +88,7 @@ async def query(request: Query):
 async def embedding(request: Query):
     logger.info(f"Received embedding request: {request}")
     try:
-        result = indexer.embed(request.query)
+        result = await indexer.embed(request.query)
         logger.info(f"Found {len(result)} results for query: {request.query}")
         return {"result": result}
     except Exception as e:
@@ -63,11 +96,84 @@ async def embedding(request: Query):
         return {"error": str(e)}    
 
 
+@router.post(
+    "/documents",
+    response_description='Get the matching chunks with their metadata',
+)
+async def documents(request: DocumentsQuery):
+    logger.info(f"Received documents query: {request.query}")
+    try:
+        result = await indexer.find_documents(request.query, request.k, search_filter(request))
+        return {"result": result}
+    except Exception as e:
+        logger.error(f"Error in processing documents query: {e}")
+        return {"error": str(e)}
+
+
+@router.post(
+    "/query/batch",
+    response_description='Query local data storage with several queries at once',
+)
+async def query_batch(request: BatchQuery):
+    logger.info(f"Received batch query with {len(request.queries)} queries")
+    try:
+        result = await indexer.find_many(request.queries, request.k, search_filter(request))
+        return {"result": result}
+    except Exception as e:
+        logger.error(f"Error in processing batch query: {e}")
+        return {"error": str(e)}
+
+
+@router.post(
+    "/embedding/batch",
+    response_description='Get embeddings for several queries at once',
+)
+async def embedding_batch(request: BatchQuery):
+    logger.info(f"Received batch embedding request with {len(request.queries)} queries")
+    try:
+        result = await indexer.embed_many(request.queries)
+        return {"result": result}
+    except Exception as e:
+        logger.error(f"Error in processing batch embedding: {e}")
+        return {"error": str(e)}
+
+
+@router.get(
+    "/embedding/cache",
+    response_description='Get embedding cache statistics',
+)
+async def embedding_cache():
+    return {"result": indexer.embedding_cache_stats()}
+
+
+@router.get(
+    "/query/cache",
+    response_description='Get retrieval cache statistics',
+)
+async def query_cache():
+    return {"result": indexer.retrieval_cache_stats()}
+
+
+@router.post(
+    "/files/state",
+    response_description='Get the content hash each file is currently indexed with',
+)
+async def files_state(request: FilesQuery):
+    try:
+        result = await asyncio.to_thread(MinimaStore.content_hashes, request.paths)
+        return {"result": result}
+    except Exception as e:
+        logger.error(f"Error in processing files state request: {e}")
+        return {"error": str(e)}
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     tasks = [
         asyncio.create_task(crawl_loop(async_queue)),
-        asyncio.create_task(index_loop(async_queue, indexer))
+        asyncio.create_task(index_loop(async_queue, indexer)),
+        asyncio.ensure_future(asyncio.get_running_loop().run_in_executor(None, indexer.backfill_lexical_index)),
+        asyncio.ensure_future(asyncio.get_running_loop().run_in_executor(None, indexer.backfill_payload)),
     ]
     await schedule_reindexing()
     try:
@@ -99,7 +205,7 @@ async def trigger_re_indexer():
         logger.error(f"error in scheduled reindexing {e}")
 
 
-@repeat_every(seconds=60*20)
+@repeat_every(seconds=CRAWL_INTERVAL_SECONDS)
 async def schedule_reindexing():
     await trigger_re_indexer()
 
@@ -1,63 +1,146 @@
 import os
 import uuid
+import time
 import asyncio
 import logging
+import multiprocessing
 from indexer import Indexer
-from concurrent.futures import ThreadPoolExecutor
+from loaders import load_and_split, lazy_load_and_split
+from storage import IndexingStatus, MinimaStore
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 logger = logging.getLogger(__name__)
 executor = ThreadPoolExecutor()
+loader_executor: ProcessPoolExecutor | None = None
 
 CONTAINER_PATH = os.environ.get("CONTAINER_PATH")
+# "incremental" only queues files whose mtime differs from the stored snapshot, "full" queues every file
+CRAWL_MODE = os.environ.get("CRAWL_MODE", "incremental")
 AVAILABLE_EXTENSIONS = [".pdf", ".xls", "xlsx", ".doc", ".docx", ".txt", ".md", ".csv", ".ppt", ".pptx"]
 
 
+def get_loader_executor(max_workers: int) -> ProcessPoolExecutor:
+    global loader_executor
+    if loader_executor is None:
+        # spawn keeps the torch/CUDA state of the parent out of the loader workers
+        loader_executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return loader_executor
+
+
+def reset_loader_executor(broken: ProcessPoolExecutor) -> None:
+    # a crashed worker breaks the whole pool, the next load starts a new one
+    global loader_executor
+    if loader_executor is broken:
+        loader_executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+
+def walk_files(path: str):
+    stack = [path]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file() and any(entry.name.endswith(ext) for ext in AVAILABLE_EXTENSIONS):
+                        yield entry.path, round(entry.stat().st_mtime)
+        except OSError as e:
+            logger.error(f"Unable to scan folder {folder}: {e}")
+
+
 async def crawl_loop(async_queue):
-    logger.info(f"Starting crawl loop with path: {CONTAINER_PATH}")
+    logger.info(f"Starting crawl loop with path: {CONTAINER_PATH} in {CRAWL_MODE} mode")
+    loop = asyncio.get_running_loop()
+    snapshot: dict[str, int] = {}
+    if CRAWL_MODE == "incremental":
+        snapshot = await loop.run_in_executor(executor, MinimaStore.load_snapshot)
     existing_file_paths: list[str] = []
-    for root, _, files in os.walk(CONTAINER_PATH):
-        logger.info(f"Processing folder: {root}")
-        for file in files:
-            if not any(file.endswith(ext) for ext in AVAILABLE_EXTENSIONS):
-                logger.info(f"Skipping file: {file}")
-                continue
-            path = os.path.join(root, file)
-            message = {
-                "path": path,
-                "file_id": str(uuid.uuid4()),
-                "last_updated_seconds": round(os.path.getmtime(path)),
-                "type": "file"
-            }
-            existing_file_paths.append(path)
-            async_queue.enqueue(message)
-            logger.info(f"File enqueue: {path}")
-        aggregate_message = {
-            "existing_file_paths": existing_file_paths,
-            "type": "all_files"
+    changed_files = 0
+    for path, last_updated_seconds in await loop.run_in_executor(executor, list, walk_files(CONTAINER_PATH)):
+        existing_file_paths.append(path)
+        known_last_updated_seconds = snapshot.get(path)
+        if known_last_updated_seconds is not None and known_last_updated_seconds >= last_updated_seconds:
+            continue
+        message = {
+            "path": path,
+            "file_id": str(uuid.uuid4()),
+            "last_updated_seconds": last_updated_seconds,
+            "type": "file"
         }
-        async_queue.enqueue(aggregate_message)
-        async_queue.enqueue({"type": "stop"})
+        async_queue.enqueue(message)
+        changed_files += 1
+        logger.info(f"File enqueue: {path}")
+    logger.info(f"Crawl found {len(existing_file_paths)} files, {changed_files} new or modified")
+    aggregate_message = {
+        "existing_file_paths": existing_file_paths,
+        "type": "all_files"
+    }
+    async_queue.enqueue(aggregate_message)
+    async_queue.enqueue({"type": "stop"})
+
+
+async def index_file(indexer: Indexer, message, semaphore: asyncio.Semaphore) -> bool:
+    loop = asyncio.get_running_loop()
+    path = message["path"]
+    try:
+        indexing_status = await loop.run_in_executor(executor, indexer.prepare, message)
+        if indexing_status in (IndexingStatus.no_need_reindexing, IndexingStatus.duplicate):
+            return False
+        if message.get("size", 0) > indexer.config.STREAMING_THRESHOLD_BYTES:
+            # large files stream window by window so memory stays bounded by the window and batch sizes
+            await loop.run_in_executor(executor, indexer.store_stream, message, lazy_load_and_split(path))
+            return True
+        pool = get_loader_executor(indexer.config.INDEXING_WORKERS)
+        try:
+            documents = await loop.run_in_executor(pool, load_and_split, path)
+        except BrokenProcessPool:
+            logger.error(f"Loader process died while loading {path}, restarting the loader pool")
+            reset_loader_executor(pool)
+            raise
+        await loop.run_in_executor(executor, indexer.store, message, documents)
+        return True
+    except Exception as e:
+        logger.error(f"Failed to index file {path}: {e}")
+        await loop.run_in_executor(executor, indexer.abandon, message)
+        # the snapshot already has the new mtime, forget it so the next crawl tries again
+        await loop.run_in_executor(executor, MinimaStore.reset_content, [path])
+        return False
+    finally:
+        semaphore.release()
 
 
 async def index_loop(async_queue, indexer: Indexer):
     loop = asyncio.get_running_loop()
-    logger.info("Starting index loop")
+    semaphore = asyncio.Semaphore(indexer.config.INDEXING_WORKERS)
+    tasks: list[asyncio.Task] = []
+    start = time.time()
+    logger.info(f"Starting index loop with {indexer.config.INDEXING_WORKERS} workers")
     while True:
-        if async_queue.size() == 0:
-            logger.info("No files to index. Indexing stopped, all files indexed.")
-            await asyncio.sleep(1)
-            continue
         message = await async_queue.dequeue()
         logger.info(f"Processing message: {message}")
         try:
             if message["type"] == "file":
-                await loop.run_in_executor(executor, indexer.index, message)
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(index_file(indexer, message, semaphore)))
             elif message["type"] == "all_files":
+                await asyncio.gather(*tasks)
+                await loop.run_in_executor(executor, indexer.flush)
                 await loop.run_in_executor(executor, indexer.purge, message)
             elif message["type"] == "stop":
+                results = await asyncio.gather(*tasks)
+                await loop.run_in_executor(executor, indexer.flush)
+                elapsed = time.time() - start
+                logger.info(
+                    f"Crawl finished: {len(results)} files checked, {sum(results)} indexed "
+                    f"in {elapsed:.1f} seconds ({len(results) / max(elapsed, 1e-6):.2f} files/s)"
+                )
                 break
         except Exception as e:
             logger.error(f"Error in processing message: {e}")
             logger.error(f"Failed to process message: {message}")
-        await asyncio.sleep(1)
-
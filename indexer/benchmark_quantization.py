@@ -0,0 +1,84 @@
+"""
+Recall and latency of the quantized collection against exact full-precision search.
+
+Queries are stored vectors with gaussian noise added, searched with their source point
+excluded, so it needs an indexed collection:
+    python benchmark_quantization.py --queries 200 --k 10 --noise 0.05
+"""
+import math
+import time
+import random
+import argparse
+
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import SearchParams, QuantizationSearchParams, Filter, HasIdCondition
+
+from indexer import Config
+
+
+def perturb(vector: list[float], noise: float) -> list[float]:
+    # a nearby vector instead of the stored one, which would always find itself first
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x + random.gauss(0, noise * norm / math.sqrt(len(vector))) for x in vector]
+
+
+def search(client: QdrantClient, query, k: int, params: SearchParams) -> tuple[set, float]:
+    source_id, vector = query
+    start = time.perf_counter()
+    found = client.query_points(
+        collection_name=Config.QDRANT_COLLECTION,
+        query=vector,
+        query_filter=Filter(must_not=[HasIdCondition(has_id=[source_id])]),
+        limit=k,
+        search_params=params,
+        with_payload=False
+    )
+    return {point.id for point in found.points}, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--noise", type=float, default=0.05, help="noise norm relative to the vector norm")
+    parser.add_argument("--oversampling", type=float, default=Config.QUANTIZATION_OVERSAMPLING)
+    args = parser.parse_args()
+
+    client = QdrantClient(host=Config.QDRANT_BOOTSTRAP)
+    points, _ = client.scroll(
+        collection_name=Config.QDRANT_COLLECTION,
+        limit=args.queries * 10,
+        with_payload=False,
+        with_vectors=True
+    )
+    queries = [
+        (point.id, perturb(point.vector, args.noise))
+        for point in random.sample(points, min(args.queries, len(points)))
+    ]
+
+    modes = {
+        "quantized": SearchParams(quantization=QuantizationSearchParams(rescore=False)),
+        "quantized+rescore": SearchParams(
+            quantization=QuantizationSearchParams(rescore=True, oversampling=args.oversampling)
+        ),
+        "full precision": SearchParams(quantization=QuantizationSearchParams(ignore=True)),
+    }
+    ground_truth = SearchParams(exact=True, quantization=QuantizationSearchParams(ignore=True))
+    exact = [search(client, query, args.k, ground_truth)[0] for query in queries]
+    print(f"{len(queries)} queries, k={args.k}, quantization={Config.VECTOR_QUANTIZATION}")
+    for name, params in modes.items():
+        recalls, latencies = [], []
+        for query, expected in zip(queries, exact):
+            found, latency = search(client, query, args.k, params)
+            recalls.append(len(found & expected) / max(len(expected), 1))
+            latencies.append(latency)
+        latencies.sort()
+        print(
+            f"{name:>18}: recall@{args.k}={sum(recalls) / len(recalls):.4f} "
+            f"p50={latencies[len(latencies) // 2] * 1000:.2f}ms "
+            f"p99={latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
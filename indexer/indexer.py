@@ -1,46 +1,38 @@
 import os
 import uuid
+import hashlib
 import torch
 import logging
-import time
+import asyncio
+import threading
 from dataclasses import dataclass
-from typing import List, Dict
+from typing import List, Dict, Iterable
 from pathlib import Path
 
-from qdrant_client import QdrantClient
-from langchain_qdrant import QdrantVectorStore
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_huggingface import HuggingFaceEmbeddings
-from qdrant_client.http.models import Distance, VectorParams, Filter, FieldCondition, MatchValue
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-
-from langchain_community.document_loaders import (
-    TextLoader,
-    CSVLoader,
-    Docx2txtLoader,
-    UnstructuredExcelLoader,
-    PyMuPDFLoader,
-    UnstructuredPowerPointLoader,
+from qdrant_client.http.models import (
+    Distance, VectorParams, Filter, FieldCondition, MatchValue, MatchAny, PointStruct, PointIdsList, ValuesCount,
+    HasIdCondition, Range, QueryRequest, SearchParams, QuantizationSearchParams, ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+    BinaryQuantization, BinaryQuantizationConfig, Disabled, VectorParamsDiff, IsEmptyCondition, PayloadField
 )
 
+import loaders
 from storage import MinimaStore, IndexingStatus
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from micro_batcher import MicroBatcher
+from vector_store import create_clients
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from retrieval_cache import RetrievalCache
 
 logger = logging.getLogger(__name__)
 
 
 @dataclass
 class Config:
-    EXTENSIONS_TO_LOADERS = {
-        ".pdf": PyMuPDFLoader,
-        ".pptx": UnstructuredPowerPointLoader,
-        ".ppt": UnstructuredPowerPointLoader,
-        ".xls": UnstructuredExcelLoader,
-        ".xlsx": UnstructuredExcelLoader,
-        ".docx": Docx2txtLoader,
-        ".doc": Docx2txtLoader,
-        ".txt": TextLoader,
-        ".md": TextLoader,
-        ".csv": CSVLoader,
-    }
+    EXTENSIONS_TO_LOADERS = loaders.EXTENSIONS_TO_LOADERS
     
     DEVICE = torch.device(
         "mps" if torch.backends.mps.is_available() else
@@ -53,179 +45,889 @@ class Config:
     CONTAINER_PATH = os.environ.get("CONTAINER_PATH")
     QDRANT_COLLECTION = "mnm_storage"
     QDRANT_BOOTSTRAP = "qdrant"
+    # "qdrant" uses the qdrant container, "local" keeps vectors in-process next to database.db
+    VECTOR_STORE = os.environ.get("VECTOR_STORE", "qdrant")
+    VECTOR_STORE_PATH = os.environ.get("VECTOR_STORE_PATH", "/indexer/storage/vectors")
+    # "none", "int8" or "binary", quantized vectors stay in RAM and the originals move to disk
+    VECTOR_QUANTIZATION = os.environ.get("VECTOR_QUANTIZATION", "none")
+    QUANTIZATION_OVERSAMPLING = float(os.environ.get("QUANTIZATION_OVERSAMPLING", 2.0))
+    QUANTIZATION_RESCORE = os.environ.get("QUANTIZATION_RESCORE", "true").lower() == "true"
+
+    # bm25 over an sqlite fts5 index, fused with the dense results by reciprocal rank
+    HYBRID_SEARCH = os.environ.get("HYBRID_SEARCH", "false").lower() == "true"
+    LEXICAL_INDEX_PATH = os.environ.get("LEXICAL_INDEX_PATH", "/indexer/storage/lexical.db")
+    HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", 20))
+    RRF_K = int(os.environ.get("RRF_K", 60))
+    # restrict the dense search to chunks that match lexically, when there are any
+    LEXICAL_PREFILTER = os.environ.get("LEXICAL_PREFILTER", "false").lower() == "true"
     EMBEDDING_MODEL_ID = os.environ.get("EMBEDDING_MODEL_ID")
     EMBEDDING_SIZE = os.environ.get("EMBEDDING_SIZE")
     
-    CHUNK_SIZE = 512
-    CHUNK_OVERLAP = 100
+    CHUNK_SIZE = loaders.CHUNK_SIZE
+    CHUNK_OVERLAP = loaders.CHUNK_OVERLAP
+    SEARCH_K = 4
+    INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 2))
+    # how long each indexing embedding call waits for in-flight queries before embedding anyway
+    INDEXING_YIELD_SECONDS = float(os.environ.get("INDEXING_YIELD_SECONDS", 0.5))
+    QUERY_BATCH_MAX_SIZE = int(os.environ.get("QUERY_BATCH_MAX_SIZE", 32))
+    QUERY_BATCH_MAX_WAIT_MS = float(os.environ.get("QUERY_BATCH_MAX_WAIT_MS", 5))
+
+    EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 32))
+    INDEXING_BATCH_SIZE = int(os.environ.get("INDEXING_BATCH_SIZE", 256))
+    INDEXING_BATCH_MAX_BYTES = int(os.environ.get("INDEXING_BATCH_MAX_BYTES", 4 * 1024 * 1024))
+    # every worker is a loader process of its own, parsers of large office files need a lot of memory
+    INDEXING_WORKERS = int(os.environ.get("INDEXING_WORKERS", min(os.cpu_count() or 1, 4)))
+    # files above this size are loaded lazily in windows instead of in the loader process pool
+    STREAMING_THRESHOLD_BYTES = int(os.environ.get("STREAMING_THRESHOLD_BYTES", 32 * 1024 * 1024))
+    STREAMING_WINDOW_BYTES = loaders.STREAMING_WINDOW_BYTES
+    PURGE_BATCH_SIZE = int(os.environ.get("PURGE_BATCH_SIZE", 1000))
+
+    EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "/indexer/storage/embedding_cache.db")
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 500_000))
+
+    RETRIEVAL_CACHE_ENABLED = os.environ.get("RETRIEVAL_CACHE_ENABLED", "true").lower() == "true"
+    RETRIEVAL_CACHE_MAX_ENTRIES = int(os.environ.get("RETRIEVAL_CACHE_MAX_ENTRIES", 1024))
+    RETRIEVAL_CACHE_TTL_SECONDS = float(os.environ.get("RETRIEVAL_CACHE_TTL_SECONDS", 300))
+
+
+def file_digest(file_path: str) -> tuple[str, int]:
+    digest = hashlib.sha256()
+    size = 0
+    with open(file_path, "rb") as f:
+        while block := f.read(1024 * 1024):
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+def chunk_ids(file_path: str, documents: List[Document], occurrences: Dict[str, int] | None = None) -> List[str]:
+    # the id depends on the chunk text and on how many identical chunks precede it,
+    # so appending to or editing part of a file keeps the ids of untouched chunks
+    occurrences = {} if occurrences is None else occurrences
+    ids = []
+    for doc in documents:
+        text_hash = hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+        occurrence = occurrences.get(text_hash, 0)
+        occurrences[text_hash] = occurrence + 1
+        ids.append(str(uuid.uuid5(uuid.NAMESPACE_URL, f"{file_path}:{text_hash}:{occurrence}")))
+    return ids
+
+
+def rekey_chunk_id(chunk_id: str, content_hash: str) -> str:
+    # used when the path-based id is still held by another file, e.g. by a duplicate
+    # that kept the chunks after the original was edited or removed
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{chunk_id}:{content_hash}"))
+
 
 class Indexer:
     def __init__(self):
         self.config = Config()
-        self.qdrant = self._initialize_qdrant()
+        self.inference_executor = ThreadPoolExecutor(
+            max_workers=self.config.INFERENCE_WORKERS,
+            thread_name_prefix="inference"
+        )
+        self.qdrant, self.async_qdrant = create_clients(
+            backend=self.config.VECTOR_STORE,
+            host=self.config.QDRANT_BOOTSTRAP,
+            path=self.config.VECTOR_STORE_PATH,
+            executor=self.inference_executor
+        )
+        self._active_queries = 0
+        self._queries_idle = threading.Condition()
+        self.query_batcher = MicroBatcher(
+            embed_many=self.embed_many,
+            max_batch_size=self.config.QUERY_BATCH_MAX_SIZE,
+            max_wait_seconds=self.config.QUERY_BATCH_MAX_WAIT_MS / 1000
+        )
         self.embed_model = self._initialize_embeddings()
-        self.document_store = self._setup_collection()
-        self.text_splitter = self._initialize_text_splitter()
+        self.lexical_index = LexicalIndex(self.config.LEXICAL_INDEX_PATH) if self.config.HYBRID_SEARCH else None
+        self.retrieval_cache = RetrievalCache(
+            max_entries=self.config.RETRIEVAL_CACHE_MAX_ENTRIES,
+            ttl_seconds=self.config.RETRIEVAL_CACHE_TTL_SECONDS
+        ) if self.config.RETRIEVAL_CACHE_ENABLED else None
+        self._setup_collection()
+        self._pending_documents = []
+        self._pending_bytes = 0
+        self._pending_lock = threading.Lock()
+        # batches are embedded one at a time outside _pending_lock, flush waits for the ones taken before it
+        self._store_lock = threading.Lock()
+        self._stored = threading.Condition(self._pending_lock)
+        self._storing: set[int] = set()
+        self._next_batch = 0
+        self._unstored: Dict[str, int] = {}
+        # content state of files whose chunks are still queued, recorded once the batch is stored
+        self._pending_content: Dict[str, tuple[str, int]] = {}
+        self._failed_paths: set[str] = set()
+        # content hashes being indexed and the identical files waiting for their chunks
+        self._in_flight: Dict[str, str] = {}
+        self._followers: Dict[str, list[str]] = {}
 
-    def _initialize_qdrant(self) -> QdrantClient:
-        return QdrantClient(host=self.config.QDRANT_BOOTSTRAP)
-
-    def _initialize_embeddings(self) -> HuggingFaceEmbeddings:
-        return HuggingFaceEmbeddings(
+    def _initialize_embeddings(self) -> Embeddings:
+        embed_model = HuggingFaceEmbeddings(
             model_name=self.config.EMBEDDING_MODEL_ID,
             model_kwargs={
                 'device': self.config.DEVICE
             },
             encode_kwargs={
                 'normalize_embeddings': False,
-                'batch_size': 1
+                'batch_size': self.config.EMBEDDING_BATCH_SIZE
             }
         )
+        if not self.config.EMBEDDING_CACHE_ENABLED:
+            return embed_model
+        cache = EmbeddingCache(
+            path=self.config.EMBEDDING_CACHE_PATH,
+            model_id=self.config.EMBEDDING_MODEL_ID,
+            max_entries=self.config.EMBEDDING_CACHE_MAX_ENTRIES
+        )
+        return CachedEmbeddings(embed_model, cache)
 
-    def _initialize_text_splitter(self) -> RecursiveCharacterTextSplitter:
-        return RecursiveCharacterTextSplitter(
-            chunk_size=self.config.CHUNK_SIZE,
-            chunk_overlap=self.config.CHUNK_OVERLAP
+    def _quantization_config(self):
+        if self.config.VECTOR_QUANTIZATION == "none":
+            return None
+        if self.config.VECTOR_QUANTIZATION == "int8":
+            return ScalarQuantization(
+                scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+            )
+        if self.config.VECTOR_QUANTIZATION == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+        raise ValueError(f"Unsupported vector quantization: {self.config.VECTOR_QUANTIZATION}")
+
+    def _search_params(self) -> SearchParams | None:
+        if self.config.VECTOR_QUANTIZATION == "none":
+            return None
+        return SearchParams(
+            quantization=QuantizationSearchParams(
+                rescore=self.config.QUANTIZATION_RESCORE,
+                oversampling=self.config.QUANTIZATION_OVERSAMPLING
+            )
         )
 
-    def _setup_collection(self) -> QdrantVectorStore:
+    def _setup_collection(self) -> None:
+        quantization_config = self._quantization_config()
         if not self.qdrant.collection_exists(self.config.QDRANT_COLLECTION):
             self.qdrant.create_collection(
                 collection_name=self.config.QDRANT_COLLECTION,
                 vectors_config=VectorParams(
                     size=self.config.EMBEDDING_SIZE,
-                    distance=Distance.COSINE
+                    distance=Distance.COSINE,
+                    on_disk=quantization_config is not None
                 ),
+                quantization_config=quantization_config,
             )
+        else:
+            # collections created with another VECTOR_QUANTIZATION are migrated in place
+            params = self.qdrant.get_collection(self.config.QDRANT_COLLECTION).config
+            on_disk = quantization_config is not None
+            if (params.quantization_config != quantization_config
+                    or bool(params.params.vectors.on_disk) != on_disk):
+                logger.info(f"Updating collection to {self.config.VECTOR_QUANTIZATION} vector quantization")
+                self.qdrant.update_collection(
+                    collection_name=self.config.QDRANT_COLLECTION,
+                    vectors_config={"": VectorParamsDiff(on_disk=on_disk)},
+                    quantization_config=quantization_config or Disabled.DISABLED,
+                )
         self.qdrant.create_payload_index(
             collection_name=self.config.QDRANT_COLLECTION,
             field_name="fpath",
             field_schema="keyword"
         )
-        return QdrantVectorStore(
-            client=self.qdrant,
+        self.qdrant.create_payload_index(
             collection_name=self.config.QDRANT_COLLECTION,
-            embedding=self.embed_model,
+            field_name="content_hash",
+            field_schema="keyword"
         )
+        for field_name, field_schema in (
+                ("extension", "keyword"),
+                ("folders", "keyword"),
+                ("mtime", "integer"),
+                ("size", "integer")):
+            self.qdrant.create_payload_index(
+                collection_name=self.config.QDRANT_COLLECTION,
+                field_name=field_name,
+                field_schema=field_schema
+            )
 
-    def _create_loader(self, file_path: str):
-        file_extension = Path(file_path).suffix.lower()
-        loader_class = self.config.EXTENSIONS_TO_LOADERS.get(file_extension)
-        
-        if not loader_class:
-            raise ValueError(f"Unsupported file type: {file_extension}")
-        
-        return loader_class(file_path=file_path)
+    def _add_to_batch(self, chunks: List[tuple[str, Document]]) -> None:
+        batches = []
+        with self._pending_lock:
+            for doc_id, doc in chunks:
+                self._pending_documents.append((doc_id, doc))
+                self._pending_bytes += len(doc.page_content.encode("utf-8"))
+                path = doc.metadata["file_path"]
+                self._unstored[path] = self._unstored.get(path, 0) + 1
+                if (len(self._pending_documents) >= self.config.INDEXING_BATCH_SIZE
+                        or self._pending_bytes >= self.config.INDEXING_BATCH_MAX_BYTES):
+                    batches.append(self._take_batch())
+        for ticket, batch in batches:
+            self._store(ticket, batch)
 
-    def _process_file(self, loader) -> List[str]:
-        try:
-            documents = loader.load_and_split(self.text_splitter)
-            if not documents:
-                logger.warning(f"No documents loaded from {loader.file_path}")
-                return []
+    def _take_batch(self) -> tuple[int, List[tuple[str, Document]]]:
+        # called with _pending_lock held
+        batch = self._pending_documents
+        self._pending_documents = []
+        self._pending_bytes = 0
+        ticket = self._next_batch
+        self._next_batch += 1
+        self._storing.add(ticket)
+        return ticket, batch
 
-            for doc in documents:
-                doc.metadata['file_path'] = loader.file_path
-
-            # Xử lý theo batch để giảm sử dụng bộ nhớ
-            batch_size = 2
-            all_ids = []
-            
-            for i in range(0, len(documents), batch_size):
-                batch = documents[i:i+batch_size]
-                uuids = [str(uuid.uuid4()) for _ in range(len(batch))]
-                ids = self.document_store.add_documents(documents=batch, ids=uuids)
-                all_ids.extend(ids)
-                # Gợi ý garbage collector chạy
-                import gc
-                gc.collect()
-            
-            logger.info(f"Successfully processed {len(all_ids)} documents from {loader.file_path}")
-            return all_ids
-            
+    def _store(self, ticket: int, batch: List[tuple[str, Document]]) -> int:
+        try:
+            with self._store_lock:
+                stored = self._store_batch(batch)
         except Exception as e:
-            logger.error(f"Error processing file {loader.file_path}: {str(e)}")
-            return []
+            hashes = {doc.metadata["file_path"]: doc.metadata.get("content_hash") for _, doc in batch}
+            logger.error(f"Failed to store batch of {len(batch)} documents from {len(hashes)} files: {e}")
+            with self._pending_lock:
+                self._batch_done(ticket, batch)
+                for path, content_hash in hashes.items():
+                    if self._pending_content.pop(path, None) is None:
+                        self._failed_paths.add(path)
+                    self._release(path, content_hash)
+                # the next crawl indexes these files again
+                MinimaStore.reset_content(list(hashes))
+            return 0
+        with self._pending_lock:
+            for path in self._batch_done(ticket, batch):
+                if path in self._pending_content:
+                    self._content_stored(path, *self._pending_content.pop(path))
+        return stored
+
+    def _batch_done(self, ticket: int, batch: List[tuple[str, Document]]) -> List[str]:
+        # called with _pending_lock held, returns the files that have no chunks left to store
+        done = []
+        for _, doc in batch:
+            path = doc.metadata["file_path"]
+            self._unstored[path] -= 1
+            if not self._unstored[path]:
+                del self._unstored[path]
+                done.append(path)
+        self._storing.discard(ticket)
+        self._stored.notify_all()
+        return done
 
-    def index(self, message: Dict[str, any]) -> None:
-        start = time.time()
+    def _store_batch(self, batch: List[tuple[str, Document]]) -> int:
+        texts = [doc.page_content for _, doc in batch]
+        vectors = []
+        for i in range(0, len(texts), self.config.EMBEDDING_BATCH_SIZE):
+            # queries take priority, indexing yields to them before every embedding call
+            self._wait_for_idle_queries()
+            vectors.extend(self.embed_model.embed_documents(texts[i:i + self.config.EMBEDDING_BATCH_SIZE]))
+        points = [
+            PointStruct(
+                id=doc_id,
+                vector=vector,
+                payload={
+                    "page_content": doc.page_content,
+                    "metadata": doc.metadata,
+                    **self._path_payload([doc.metadata["file_path"]]),
+                    "content_hash": doc.metadata.get("content_hash"),
+                    "mtime": doc.metadata.get("last_updated_seconds"),
+                    "size": doc.metadata.get("size"),
+                }
+            )
+            for (doc_id, doc), vector in zip(batch, vectors)
+        ]
+        self.qdrant.upsert(
+            collection_name=self.config.QDRANT_COLLECTION,
+            points=points,
+            wait=True
+        )
+        if self.lexical_index is not None:
+            self.lexical_index.add((doc_id, doc.page_content) for doc_id, doc in batch)
+        self._collection_changed()
+        logger.info(f"Embedded and stored batch of {len(points)} documents")
+        return len(points)
+
+    def _collection_changed(self) -> None:
+        if self.retrieval_cache is not None:
+            self.retrieval_cache.bump()
+
+    def _record_content(self, path: str, content_hash: str, size: int) -> None:
+        # a file only counts as indexed once all of its chunks are stored
+        with self._pending_lock:
+            if path in self._failed_paths:
+                self._failed_paths.discard(path)
+                return
+            if self._unstored.get(path):
+                self._pending_content[path] = (content_hash, size)
+                return
+            self._content_stored(path, content_hash, size)
+
+    def _content_stored(self, path: str, content_hash: str, size: int) -> None:
+        # called with _pending_lock held
+        MinimaStore.update_content(path, content_hash, size)
+        if self._in_flight.get(content_hash) != path:
+            return
+        del self._in_flight[content_hash]
+        followers = self._followers.pop(content_hash, [])
+        for follower in followers:
+            if self._add_path_reference(path, follower):
+                logger.info(f"Reusing embeddings of {path} for duplicate {follower}")
+                MinimaStore.update_content(follower, content_hash, size)
+            else:
+                MinimaStore.reset_content([follower])
+        if followers:
+            self._collection_changed()
+
+    def _release(self, path: str, content_hash: str | None) -> None:
+        # called with _pending_lock held, identical files waiting on a failed file are indexed by the next crawl
+        if content_hash is None or self._in_flight.get(content_hash) != path:
+            return
+        del self._in_flight[content_hash]
+        followers = self._followers.pop(content_hash, [])
+        if followers:
+            MinimaStore.reset_content(followers)
+
+    def abandon(self, message: Dict[str, any]) -> None:
+        with self._pending_lock:
+            self._release(message["path"], message.get("content_hash"))
+
+    def _claim(self, path: str, content_hash: str, size: int, incremental: bool) -> str | None:
+        # identical files are embedded once, the others only add their path to its chunks
+        with self._pending_lock:
+            leader = self._in_flight.get(content_hash)
+            if leader is not None and leader != path:
+                if incremental:
+                    # the file still has chunks of its own, they are updated in place
+                    return None
+                self._followers.setdefault(content_hash, []).append(path)
+                logger.info(f"Waiting for {leader} to be stored to reuse its embeddings for duplicate {path}")
+                return leader
+            if leader is None and not incremental:
+                duplicate_of = MinimaStore.find_duplicate(path, content_hash, size)
+                if duplicate_of is not None and self._add_path_reference(duplicate_of, path):
+                    self._collection_changed()
+                    logger.info(f"Reusing embeddings of {duplicate_of} for duplicate {path}")
+                    MinimaStore.update_content(path, content_hash, size)
+                    return duplicate_of
+            self._in_flight[content_hash] = path
+            return None
+
+    def flush(self) -> int:
+        with self._pending_lock:
+            ticket, batch = self._take_batch() if self._pending_documents else (self._next_batch - 1, [])
+        stored = self._store(ticket, batch) if batch else 0
+        with self._pending_lock:
+            self._stored.wait_for(lambda: all(pending > ticket for pending in self._storing))
+        return stored
+
+    def prepare(self, message: Dict[str, any]) -> IndexingStatus:
         path, file_id, last_updated_seconds = message["path"], message["file_id"], message["last_updated_seconds"]
         logger.info(f"Processing file: {path} (ID: {file_id})")
         indexing_status: IndexingStatus = MinimaStore.check_needs_indexing(fpath=path, last_updated_seconds=last_updated_seconds)
-        if indexing_status != IndexingStatus.no_need_reindexing:
-            logger.info(f"Indexing needed for {path} with status: {indexing_status}")
-            try:
-                if indexing_status == IndexingStatus.need_reindexing:
-                    logger.info(f"Removing {path} from index storage for reindexing")
-                    self.remove_from_storage(files_to_remove=[path])
-                loader = self._create_loader(path)
-                ids = self._process_file(loader)
-                if ids:
-                    logger.info(f"Successfully indexed {path} with IDs: {ids}")
-            except Exception as e:
-                logger.error(f"Failed to index file {path}: {str(e)}")
-        else:
+        if indexing_status == IndexingStatus.no_need_reindexing:
             logger.info(f"Skipping {path}, no indexing required. timestamp didn't change")
-        end = time.time()
-        logger.info(f"Processing took {end - start} seconds for file {path}")
+            return indexing_status
+
+        content_hash, size = file_digest(path)
+        message["content_hash"], message["size"] = content_hash, size
+        if indexing_status == IndexingStatus.need_reindexing:
+            if MinimaStore.is_content_unchanged(path, content_hash, size):
+                logger.info(f"Skipping {path}, timestamp changed but content is the same")
+                return IndexingStatus.no_need_reindexing
+            MinimaStore.update_content(path, content_hash=None, size=None)
+            self.flush()
+            with self._pending_lock:
+                duplicate_in_flight = self._in_flight.get(content_hash) not in (None, path)
+            if (duplicate_in_flight or MinimaStore.find_duplicate(path, content_hash, size) is not None
+                    or self._is_shared(path)):
+                logger.info(f"Removing {path} from index storage for reindexing")
+                self.remove_from_storage(files_to_remove=[path])
+            else:
+                logger.info(f"Reindexing only changed chunks of {path}")
+                message["incremental"] = True
+
+        if self._claim(path, content_hash, size, message.get("incremental", False)) is not None:
+            return IndexingStatus.duplicate
+        return indexing_status
+
+    def store(self, message: Dict[str, any], documents: List[Document]) -> List[str]:
+        return self.store_stream(message, [documents])
+
+    def store_stream(self, message: Dict[str, any], windows: Iterable[List[Document]]) -> List[str]:
+        path, content_hash = message["path"], message.get("content_hash")
+        with self._pending_lock:
+            self._failed_paths.discard(path)
+        existing_ids = set(self._chunk_ids_of(path)) if message.get("incremental") else set()
+        occurrences: Dict[str, int] = {}
+        ids = []
+        queued = 0
+        for documents in windows:
+            for doc in documents:
+                doc.metadata["content_hash"] = content_hash
+                doc.metadata["last_updated_seconds"] = message.get("last_updated_seconds")
+                doc.metadata["size"] = message.get("size")
+            window_ids = chunk_ids(path, documents, occurrences)
+            foreign_ids = self._foreign_ids([doc_id for doc_id in window_ids if doc_id not in existing_ids], path)
+            if foreign_ids:
+                window_ids = [
+                    rekey_chunk_id(doc_id, content_hash) if doc_id in foreign_ids else doc_id
+                    for doc_id in window_ids
+                ]
+            ids.extend(window_ids)
+            kept_ids = [doc_id for doc_id in window_ids if doc_id in existing_ids]
+            if kept_ids:
+                self.qdrant.set_payload(
+                    collection_name=self.config.QDRANT_COLLECTION,
+                    payload={
+                        "content_hash": content_hash,
+                        "mtime": message.get("last_updated_seconds"),
+                        "size": message.get("size"),
+                    },
+                    points=kept_ids,
+                    wait=True
+                )
+                self._collection_changed()
+            chunks = [(doc_id, doc) for doc_id, doc in zip(window_ids, documents) if doc_id not in existing_ids]
+            self._add_to_batch(chunks)
+            queued += len(chunks)
+
+        stale_ids = list(existing_ids - set(ids))
+        if stale_ids:
+            self.qdrant.delete(
+                collection_name=self.config.QDRANT_COLLECTION,
+                points_selector=PointIdsList(points=stale_ids),
+                wait=True
+            )
+            if self.lexical_index is not None:
+                self.lexical_index.delete(stale_ids)
+            self._collection_changed()
+        if not ids:
+            logger.warning(f"No documents loaded from {path}")
+            self.abandon(message)
+            return []
+        self._record_content(path, content_hash, message.get("size"))
+        logger.info(
+            f"Queued {queued} of {len(ids)} documents from {path} for embedding, "
+            f"{len(stale_ids)} stale chunks removed"
+        )
+        return ids
+
+    def _foreign_ids(self, ids: List[str], path: str) -> set[str]:
+        # ids that are stored for other files only, upserting them would take the chunks away from those files
+        if not ids:
+            return set()
+        records = self.qdrant.retrieve(
+            collection_name=self.config.QDRANT_COLLECTION,
+            ids=ids,
+            with_payload=["fpath"],
+            with_vectors=False
+        )
+        return {
+            str(record.id) for record in records
+            if path not in self._as_path_list(record.payload.get("fpath"))
+        }
+
+    def _chunk_ids_of(self, path: str) -> List[str]:
+        return self._point_ids(Filter(must=[FieldCondition(key="fpath", match=MatchValue(value=path))]))
+
+    def _point_ids(self, scroll_filter: Filter) -> List[str]:
+        ids = []
+        offset = None
+        while True:
+            points, offset = self.qdrant.scroll(
+                collection_name=self.config.QDRANT_COLLECTION,
+                scroll_filter=scroll_filter,
+                limit=1024,
+                offset=offset,
+                with_payload=False,
+                with_vectors=False
+            )
+            ids.extend(str(point.id) for point in points)
+            if offset is None:
+                return ids
+
+    def _is_shared(self, path: str) -> bool:
+        points, _ = self.qdrant.scroll(
+            collection_name=self.config.QDRANT_COLLECTION,
+            scroll_filter=Filter(
+                must=[
+                    FieldCondition(key="fpath", match=MatchValue(value=path)),
+                    FieldCondition(key="fpath", values_count=ValuesCount(gt=1)),
+                ]
+            ),
+            limit=1,
+            with_payload=False
+        )
+        return bool(points)
+
+    def _add_path_reference(self, duplicate_of: str, path: str) -> bool:
+        # only the chunks of duplicate_of, other files may have been stored with the same content hash
+        ids = self._chunk_ids_of(duplicate_of)
+        if not ids:
+            return False
+        points = self.qdrant.retrieve(
+            collection_name=self.config.QDRANT_COLLECTION,
+            ids=ids[:1],
+            with_payload=["fpath"],
+            with_vectors=False
+        )
+        fpaths = self._as_path_list(points[0].payload.get("fpath"))
+        if path not in fpaths:
+            self.qdrant.set_payload(
+                collection_name=self.config.QDRANT_COLLECTION,
+                payload=self._path_payload(fpaths + [path]),
+                points=ids,
+                wait=True
+            )
+        return True
+
+    def _path_payload(self, fpaths: list[str]) -> Dict[str, any]:
+        # every ancestor folder is stored so a folder filter is a single keyword match
+        folders = set()
+        for fpath in fpaths:
+            folder = os.path.dirname(fpath)
+            while folder and folder not in folders:
+                folders.add(folder)
+                parent = os.path.dirname(folder)
+                if parent == folder:
+                    break
+                folder = parent
+        return {
+            "fpath": fpaths,
+            "folders": sorted(folders),
+            "extension": sorted({Path(fpath).suffix.lower() for fpath in fpaths}),
+        }
+
+    def build_filter(
+            self,
+            file_type: str | None = None,
+            folder: str | None = None,
+            modified_after: int | None = None,
+            modified_before: int | None = None
+    ) -> Filter | None:
+        conditions = []
+        if file_type:
+            extension = file_type.lower() if file_type.startswith(".") else f".{file_type.lower()}"
+            conditions.append(FieldCondition(key="extension", match=MatchValue(value=extension)))
+        if folder:
+            if self.config.LOCAL_FILES_PATH and folder.startswith(self.config.LOCAL_FILES_PATH):
+                folder = folder.replace(self.config.LOCAL_FILES_PATH, self.config.CONTAINER_PATH, 1)
+            elif not folder.startswith(self.config.CONTAINER_PATH or "/"):
+                folder = os.path.join(self.config.CONTAINER_PATH, folder)
+            conditions.append(FieldCondition(key="folders", match=MatchValue(value=os.path.normpath(folder))))
+        if modified_after is not None or modified_before is not None:
+            conditions.append(FieldCondition(key="mtime", range=Range(gte=modified_after, lte=modified_before)))
+        return Filter(must=conditions) if conditions else None
+
+    @staticmethod
+    def _as_path_list(fpath) -> list[str]:
+        if fpath is None:
+            return []
+        return fpath if isinstance(fpath, list) else [fpath]
 
     def purge(self, message: Dict[str, any]) -> None:
         existing_file_paths: list[str] = message["existing_file_paths"]
         files_to_remove = MinimaStore.find_removed_files(existing_file_paths=set(existing_file_paths))
         if len(files_to_remove) > 0:
-            logger.info(f"purge processing removing old files {files_to_remove}")
+            logger.info(f"purge processing removing {len(files_to_remove)} old files")
             self.remove_from_storage(files_to_remove)
         else:
             logger.info("Nothing to purge")
 
     def remove_from_storage(self, files_to_remove: list[str]):
-        filter_conditions = Filter(
+        for i in range(0, len(files_to_remove), self.config.PURGE_BATCH_SIZE):
+            self._remove_paths(files_to_remove[i:i + self.config.PURGE_BATCH_SIZE])
+        logger.info(f"Removed {len(files_to_remove)} files from index storage")
+
+    def _remove_paths(self, files_to_remove: list[str]):
+        removed = set(files_to_remove)
+        path_filter = Filter(
+            should=[FieldCondition(key="fpath", match=MatchAny(any=files_to_remove))]
+        )
+        shared_filter = Filter(
             must=[
-                FieldCondition(
-                    key="fpath",
-                    match=MatchValue(value=fpath)
-                )
-                for fpath in files_to_remove
+                FieldCondition(key="fpath", match=MatchAny(any=files_to_remove)),
+                FieldCondition(key="fpath", values_count=ValuesCount(gt=1)),
             ]
         )
+        # chunks shared with duplicate files only lose the removed path references
+        remaining_paths: Dict[tuple, list[str]] = {}
+        offset = None
+        while True:
+            points, offset = self.qdrant.scroll(
+                collection_name=self.config.QDRANT_COLLECTION,
+                scroll_filter=shared_filter,
+                limit=256,
+                offset=offset,
+                with_payload=["fpath"]
+            )
+            for point in points:
+                remaining = [f for f in self._as_path_list(point.payload.get("fpath")) if f not in removed]
+                if remaining:
+                    remaining_paths.setdefault(tuple(remaining), []).append(str(point.id))
+            if offset is None:
+                break
+        for remaining, ids in remaining_paths.items():
+            self.qdrant.set_payload(
+                collection_name=self.config.QDRANT_COLLECTION,
+                payload=self._path_payload(list(remaining)),
+                points=ids,
+                wait=True
+            )
+            self.qdrant.set_payload(
+                collection_name=self.config.QDRANT_COLLECTION,
+                payload={"file_path": remaining[0]},
+                key="metadata",
+                points=ids,
+                wait=True
+            )
+        if self.lexical_index is not None:
+            self.lexical_index.delete(self._point_ids(path_filter))
         response = self.qdrant.delete(
             collection_name=self.config.QDRANT_COLLECTION,
-            points_selector=filter_conditions,
+            points_selector=path_filter,
             wait=True
         )
-        logger.info(f"Delete response for {len(files_to_remove)} for files: {files_to_remove} is: {response}")
+        self._collection_changed()
+        logger.debug(f"Delete response for {len(files_to_remove)} files: {response}")
 
-    def find(self, query: str) -> Dict[str, any]:
+    async def _run_inference(self, func, *args):
+        # queries take priority over indexing batches, see _wait_for_idle_queries
+        with self._queries_idle:
+            self._active_queries += 1
         try:
-            logger.info(f"Searching for: {query}")
-            found = self.document_store.search(query, search_type="similarity")
-            
-            if not found:
-                logger.info("No results found")
-                return {"links": set(), "output": ""}
-
-            links = set()
-            results = []
-            
-            for item in found:
-                path = item.metadata["file_path"].replace(
-                    self.config.CONTAINER_PATH,
-                    self.config.LOCAL_FILES_PATH
-                )
-                links.add(f"file://{path}")
-                results.append(item.page_content)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.inference_executor, func, *args)
+        finally:
+            with self._queries_idle:
+                self._active_queries -= 1
+                self._queries_idle.notify_all()
 
-            output = {
-                "links": links,
-                "output": ". ".join(results)
-            }
-            
-            logger.info(f"Found {len(found)} results")
-            return output
-            
+    def _wait_for_idle_queries(self) -> None:
+        with self._queries_idle:
+            self._queries_idle.wait_for(
+                lambda: self._active_queries == 0,
+                timeout=self.config.INDEXING_YIELD_SECONDS
+            )
+
+    def _format_results(self, found) -> Dict[str, any]:
+        links = set()
+        results = []
+        for point in found:
+            path = point.payload["metadata"]["file_path"].replace(
+                self.config.CONTAINER_PATH,
+                self.config.LOCAL_FILES_PATH
+            )
+            links.add(f"file://{path}")
+            results.append(point.payload["page_content"])
+        return {
+            "links": links,
+            "output": ". ".join(results)
+        }
+
+    async def _dense_search(self, vector: List[float], k: int, query_filter: Filter | None = None):
+        response = await self.async_qdrant.query_points(
+            collection_name=self.config.QDRANT_COLLECTION,
+            query=vector,
+            query_filter=query_filter,
+            limit=k,
+            search_params=self._search_params(),
+            with_payload=True
+        )
+        return response.points
+
+    @staticmethod
+    def _with_condition(query_filter: Filter | None, condition) -> Filter:
+        must = list(query_filter.must) if query_filter is not None and query_filter.must else []
+        return Filter(must=must + [condition])
+
+    async def _search(
+            self,
+            query: str,
+            k: int,
+            vector: List[float] | None = None,
+            query_filter: Filter | None = None
+    ):
+        if vector is None:
+            vector = await self.query_batcher.embed(query)
+        if self.lexical_index is None:
+            return await self._dense_search(vector, k, query_filter)
+
+        loop = asyncio.get_running_loop()
+        candidates = max(k, self.config.HYBRID_CANDIDATES)
+        lexical_ids = await loop.run_in_executor(
+            self.inference_executor, self.lexical_index.search, query, candidates
+        )
+        points = {}
+        if lexical_ids and query_filter is not None:
+            # the lexical index has no metadata, qdrant drops the matches outside the filter
+            allowed = await self._dense_search(
+                vector, len(lexical_ids), self._with_condition(query_filter, HasIdCondition(has_id=lexical_ids))
+            )
+            points.update((str(point.id), point) for point in allowed)
+            lexical_ids = [point_id for point_id in lexical_ids if point_id in points]
+        dense_filter = query_filter
+        if lexical_ids and self.config.LEXICAL_PREFILTER:
+            dense_filter = self._with_condition(query_filter, HasIdCondition(has_id=lexical_ids))
+        dense = await self._dense_search(vector, candidates, dense_filter)
+        dense_ids = [str(point.id) for point in dense]
+        points.update(zip(dense_ids, dense))
+        fused = reciprocal_rank_fusion([dense_ids, lexical_ids], self.config.RRF_K)[:k]
+        missing = [point_id for point_id in fused if point_id not in points]
+        if missing:
+            records = await self.async_qdrant.retrieve(
+                collection_name=self.config.QDRANT_COLLECTION,
+                ids=missing,
+                with_payload=True
+            )
+            points.update((str(record.id), record) for record in records)
+        return [points[point_id] for point_id in fused if point_id in points]
+
+    async def _cached(self, key: tuple, compute):
+        if self.retrieval_cache is None:
+            return await compute()
+        return await self.retrieval_cache.get_or_compute(key, compute)
+
+    async def _find(self, query: str, k: int, query_filter: Filter | None) -> Dict[str, any]:
+        found = await self._search(query, k, query_filter=query_filter)
+        if not found:
+            logger.info("No results found")
+            return {"links": set(), "output": ""}
+        logger.info(f"Found {len(found)} results")
+        return self._format_results(found)
+
+    async def find(self, query: str, k: int | None = None, query_filter: Filter | None = None) -> Dict[str, any]:
+        try:
+            logger.info(f"Searching for: {query}")
+            k = k or self.config.SEARCH_K
+            return await self._cached(
+                ("find", query, k, repr(query_filter)), lambda: self._find(query, k, query_filter)
+            )
         except Exception as e:
             logger.error(f"Search failed: {str(e)}")
             return {"error": "Unable to find anything for the given query"}
 
-    def embed(self, query: str):
-        return self.embed_model.embed_query(query)
\ No newline at end of file
+    async def _find_documents(self, query: str, k: int, query_filter: Filter | None) -> List[Dict[str, any]]:
+        found = await self._search(query, k, query_filter=query_filter)
+        return [
+            {"page_content": point.payload["page_content"], "metadata": point.payload["metadata"]}
+            for point in found
+        ]
+
+    async def find_documents(self, query: str, k: int, query_filter: Filter | None = None) -> List[Dict[str, any]]:
+        return await self._cached(
+            ("documents", query, k, repr(query_filter)), lambda: self._find_documents(query, k, query_filter)
+        )
+
+    async def find_many(
+            self,
+            queries: List[str],
+            k: int | None = None,
+            query_filter: Filter | None = None
+    ) -> List[Dict[str, any]]:
+        logger.info(f"Searching for {len(queries)} queries")
+        k = k or self.config.SEARCH_K
+        vectors = await self._run_inference(self.embed_model.embed_documents, queries)
+        if self.lexical_index is not None:
+            responses = await asyncio.gather(*(
+                self._search(query, k, vector, query_filter) for query, vector in zip(queries, vectors)
+            ))
+            return [self._format_results(found) for found in responses]
+        responses = await self.async_qdrant.query_batch_points(
+            collection_name=self.config.QDRANT_COLLECTION,
+            requests=[
+                QueryRequest(
+                    query=vector,
+                    filter=query_filter,
+                    limit=k,
+                    params=self._search_params(),
+                    with_payload=True
+                )
+                for vector in vectors
+            ]
+        )
+        return [self._format_results(response.points) for response in responses]
+
+    async def embed(self, query: str) -> List[float]:
+        return await self.query_batcher.embed(query)
+
+    async def embed_many(self, queries: List[str]) -> List[List[float]]:
+        return await self._run_inference(self.embed_model.embed_documents, queries)
+
+    def backfill_lexical_index(self) -> None:
+        if self.lexical_index is None or not self.lexical_index.is_empty():
+            return
+        logger.info("Building lexical index from the stored chunks")
+        offset = None
+        count = 0
+        while True:
+            points, offset = self.qdrant.scroll(
+                collection_name=self.config.QDRANT_COLLECTION,
+                limit=1024,
+                offset=offset,
+                with_payload=["page_content"],
+                with_vectors=False
+            )
+            self.lexical_index.add((str(point.id), point.payload["page_content"]) for point in points)
+            count += len(points)
+            if offset is None:
+                break
+        self._collection_changed()
+        logger.info(f"Lexical index built for {count} chunks")
+
+    def backfill_payload(self) -> None:
+        # chunks stored before the filterable payload fields existed only carry metadata.file_path
+        missing_filter = Filter(must=[IsEmptyCondition(is_empty=PayloadField(key="extension"))])
+        snapshot = None
+        offset = None
+        count = 0
+        while True:
+            points, offset = self.qdrant.scroll(
+                collection_name=self.config.QDRANT_COLLECTION,
+                scroll_filter=missing_filter,
+                limit=1024,
+                offset=offset,
+                with_payload=["fpath", "metadata", "content_hash", "mtime", "size"],
+                with_vectors=False
+            )
+            if points and snapshot is None:
+                logger.info("Adding filterable payload fields to chunks stored by an older version")
+                snapshot = MinimaStore.load_snapshot()
+            groups: Dict[tuple, list[str]] = {}
+            for point in points:
+                metadata = point.payload.get("metadata") or {}
+                fpaths = self._as_path_list(point.payload.get("fpath")) or self._as_path_list(metadata.get("file_path"))
+                if not fpaths:
+                    continue
+                mtime = point.payload.get("mtime", metadata.get("last_updated_seconds", snapshot.get(fpaths[0])))
+                size = point.payload.get("size", metadata.get("size"))
+                if size is None and os.path.exists(fpaths[0]):
+                    size = os.path.getsize(fpaths[0])
+                content_hash = point.payload.get("content_hash", metadata.get("content_hash"))
+                groups.setdefault((tuple(fpaths), mtime, size, content_hash), []).append(str(point.id))
+            for (fpaths, mtime, size, content_hash), ids in groups.items():
+                try:
+                    self.qdrant.set_payload(
+                        collection_name=self.config.QDRANT_COLLECTION,
+                        payload={
+                            **self._path_payload(list(fpaths)),
+                            "content_hash": content_hash,
+                            "mtime": mtime,
+                            "size": size,
+                        },
+                        points=ids,
+                        wait=True
+                    )
+                    count += len(ids)
+                except Exception as e:
+                    # the crawl may have reindexed or removed the file meanwhile
+                    logger.warning(f"Unable to add payload fields to chunks of {fpaths[0]}: {e}")
+            if offset is None:
+                break
+        if count:
+            self._collection_changed()
+            logger.info(f"Added filterable payload fields to {count} chunks")
+
+    def retrieval_cache_stats(self) -> Dict[str, any]:
+        if self.retrieval_cache is not None:
+            return self.retrieval_cache.stats()
+        return {"enabled": False}
+
+    def embedding_cache_stats(self) -> Dict[str, any]:
+        if isinstance(self.embed_model, CachedEmbeddings):
+            return self.embed_model.cache.stats()
+        return {"enabled": False}
\ No newline at end of file
@@ -0,0 +1,91 @@
+import re
+import sqlite3
+import logging
+import threading
+from typing import Iterable, List
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+class LexicalIndex:
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # fts5 keeps compressed postings per token and ranks with bm25,
+        # point ids are uuids so they are mapped to integer rowids
+        # the chunk text stays in qdrant, a contentless table only keeps the postings
+        # but deleting from it needs sqlite 3.43
+        contentless = sqlite3.sqlite_version_info >= (3, 43, 0)
+        options = ", content='', contentless_delete=1" if contentless else ""
+        if not contentless:
+            logger.warning(f"SQLite {sqlite3.sqlite_version} has no contentless_delete, the lexical index stores chunk text")
+        existing = self._connection.execute("SELECT sql FROM sqlite_master WHERE name = 'chunk'").fetchone()
+        if existing is not None and contentless and "contentless_delete" not in existing[0]:
+            # rebuilt from qdrant by the backfill once the index is empty
+            logger.info("Dropping lexical index that stores chunk text")
+            self._connection.execute("DROP TABLE chunk")
+            self._connection.execute("DROP TABLE IF EXISTS chunk_key")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_key (rowid INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE)"
+        )
+        self._connection.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chunk USING fts5("
+            f"content, tokenize='unicode61 remove_diacritics 2'{options})"
+        )
+        self._connection.commit()
+
+    def _delete(self, ids: List[str]) -> None:
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            placeholders = ",".join("?" * len(part))
+            self._connection.execute(
+                f"DELETE FROM chunk WHERE rowid IN (SELECT rowid FROM chunk_key WHERE id IN ({placeholders}))", part
+            )
+            self._connection.execute(f"DELETE FROM chunk_key WHERE id IN ({placeholders})", part)
+
+    def add(self, chunks: Iterable[tuple[str, str]]) -> None:
+        chunks = list(chunks)
+        if not chunks:
+            return
+        with self._lock:
+            self._delete([chunk_id for chunk_id, _ in chunks])
+            for chunk_id, content in chunks:
+                rowid = self._connection.execute("INSERT INTO chunk_key (id) VALUES (?)", (chunk_id,)).lastrowid
+                self._connection.execute("INSERT INTO chunk (rowid, content) VALUES (?, ?)", (rowid, content))
+            self._connection.commit()
+
+    def delete(self, ids: Iterable[str]) -> None:
+        ids = list(ids)
+        if not ids:
+            return
+        with self._lock:
+            self._delete(ids)
+            self._connection.commit()
+
+    def search(self, query: str, k: int) -> List[str]:
+        tokens = dict.fromkeys(token.lower() for token in TOKEN_PATTERN.findall(query))
+        if not tokens:
+            return []
+        match = " OR ".join(f'"{token}"' for token in tokens)
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT chunk_key.id FROM chunk JOIN chunk_key ON chunk_key.rowid = chunk.rowid "
+                "WHERE chunk MATCH ? ORDER BY bm25(chunk) LIMIT ?", (match, k)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM chunk_key LIMIT 1").fetchone() is None
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,80 @@
+import os
+from pathlib import Path
+from typing import Iterator, List
+
+from langchain_core.documents import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import (
+    TextLoader,
+    CSVLoader,
+    Docx2txtLoader,
+    UnstructuredExcelLoader,
+    PyMuPDFLoader,
+    UnstructuredPowerPointLoader,
+)
+
+# imported by every loader process, keep torch, the embedding model and qdrant out of this module
+
+EXTENSIONS_TO_LOADERS = {
+    ".pdf": PyMuPDFLoader,
+    ".pptx": UnstructuredPowerPointLoader,
+    ".ppt": UnstructuredPowerPointLoader,
+    ".xls": UnstructuredExcelLoader,
+    ".xlsx": UnstructuredExcelLoader,
+    ".docx": Docx2txtLoader,
+    ".doc": Docx2txtLoader,
+    ".txt": TextLoader,
+    ".md": TextLoader,
+    ".csv": CSVLoader,
+}
+
+CHUNK_SIZE = 512
+CHUNK_OVERLAP = 100
+STREAMING_WINDOW_BYTES = int(os.environ.get("STREAMING_WINDOW_BYTES", 1024 * 1024))
+
+
+def _lazy_load(file_path: str) -> Iterator[Document]:
+    file_extension = Path(file_path).suffix.lower()
+    loader_class = EXTENSIONS_TO_LOADERS.get(file_extension)
+
+    if not loader_class:
+        raise ValueError(f"Unsupported file type: {file_extension}")
+
+    if loader_class is not TextLoader:
+        yield from loader_class(file_path=file_path).lazy_load()
+        return
+
+    # TextLoader reads the whole file at once, plain text is read in line blocks instead
+    with open(file_path, encoding="utf-8", errors="replace") as f:
+        lines, size = [], 0
+        for line in f:
+            lines.append(line)
+            size += len(line)
+            if size >= STREAMING_WINDOW_BYTES:
+                yield Document(page_content="".join(lines), metadata={"source": file_path})
+                lines, size = [], 0
+        if lines:
+            yield Document(page_content="".join(lines), metadata={"source": file_path})
+
+
+def lazy_load_and_split(file_path: str) -> Iterator[List[Document]]:
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP
+    )
+    window, window_bytes = [], 0
+    for doc in _lazy_load(file_path):
+        for chunk in text_splitter.split_documents([doc]):
+            chunk.metadata['file_path'] = file_path
+            window.append(chunk)
+            window_bytes += len(chunk.page_content)
+        if window_bytes >= STREAMING_WINDOW_BYTES:
+            yield window
+            window, window_bytes = [], 0
+    if window:
+        yield window
+
+
+def load_and_split(file_path: str) -> List[Document]:
+    # runs inside the loader process pool
+    return [chunk for window in lazy_load_and_split(file_path) for chunk in window]
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+
+    def __init__(
+            self,
+            embed_many: Callable[[List[str]], Awaitable[List[List[float]]]],
+            max_batch_size: int,
+            max_wait_seconds: float
+    ):
+        self.embed_many = embed_many
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self._pending: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+
+    async def embed(self, text: str) -> List[float]:
+        # the worker is started lazily so it is bound to the server's event loop
+        if self._worker is None or self._worker.done():
+            self._pending = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._pending.put_nowait((text, future))
+        return await future
+
+    async def _collect(self) -> list[tuple[str, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._pending.get()]
+        deadline = loop.time() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size:
+            if not self._pending.empty():
+                batch.append(self._pending.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._pending.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            waiting = [(text, future) for text, future in batch if not future.done()]
+            if not waiting:
+                continue
+            try:
+                vectors = await self.embed_many([text for text, _ in waiting])
+            except Exception as e:
+                logger.error(f"Embedding batch of {len(waiting)} failed: {e}")
+                for _, future in waiting:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            logger.debug(f"Embedded micro-batch of {len(waiting)} queries")
+            for (_, future), vector in zip(waiting, vectors):
+                if not future.done():
+                    future.set_result(vector)
@@ -0,0 +1,87 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class RetrievalCache:
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # bumped on every collection change, entries and searches of an older generation are never served
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.collapsed = 0
+        self._entries: OrderedDict[Hashable, tuple[int, float, Any]] = OrderedDict()
+        self._in_flight: dict[tuple[Hashable, int], asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    def bump(self) -> None:
+        # called from the indexing threads
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def _get(self, key: Hashable) -> tuple[int, bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                generation, stored_at, result = entry
+                if generation == self.generation and time.monotonic() - stored_at < self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self.generation, True, result
+                del self._entries[key]
+            return self.generation, False, None
+
+    def _put(self, key: Hashable, generation: int, result: Any) -> None:
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (generation, time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        generation, found, result = self._get(key)
+        if found:
+            return result
+        # identical queries arriving while the first one is searched wait for its result
+        in_flight = self._in_flight.get((key, generation))
+        if in_flight is not None:
+            self.collapsed += 1
+            return await asyncio.shield(in_flight)
+        self.misses += 1
+        # the search runs as its own task so a cancelled caller does not cancel the others waiting on it
+        task = asyncio.ensure_future(self._compute(key, generation, compute))
+        # mark a failure as retrieved when every caller has gone
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._in_flight[(key, generation)] = task
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: Hashable, generation: int, compute: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            result = await compute()
+        finally:
+            del self._in_flight[(key, generation)]
+        self._put(key, generation, result)
+        return result
+
+    def stats(self) -> dict[str, Any]:
+        total = self.hits + self.misses + self.collapsed
+        return {
+            "generation": self.generation,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "collapsed": self.collapsed,
+            "hit_rate": (self.hits + self.collapsed) / total if total else 0.0,
+        }
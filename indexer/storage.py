@@ -1,4 +1,5 @@
 import logging
+from sqlalchemy import inspect, text, update
 from sqlmodel import Field, Session, SQLModel, create_engine, select
 
 from singleton import Singleton
@@ -11,16 +12,21 @@ class IndexingStatus(Enum):
     new_file = 1
     need_reindexing = 2
     no_need_reindexing = 3
+    duplicate = 4
 
 
 class MinimaDoc(SQLModel, table=True):
     fpath: str = Field(primary_key=True)
     last_updated_seconds: int | None = Field(default=None, index=True)
+    content_hash: str | None = Field(default=None, index=True)
+    size: int | None = None
 
 
 class MinimaDocUpdate(SQLModel):
     fpath: str | None = None
     last_updated_seconds: int | None = None
+    content_hash: str | None = None
+    size: int | None = None
 
 
 sqlite_file_name = "/indexer/storage/database.db"
@@ -35,6 +41,15 @@ class MinimaStore(metaclass=Singleton):
     @staticmethod
     def create_db_and_tables():
         SQLModel.metadata.create_all(engine)
+        # create_all does not alter tables created by older versions
+        with engine.begin() as connection:
+            columns = {column["name"] for column in inspect(connection).get_columns("minimadoc")}
+            for column, column_type in (("content_hash", "VARCHAR"), ("size", "INTEGER")):
+                if column not in columns:
+                    connection.execute(text(f"ALTER TABLE minimadoc ADD COLUMN {column} {column_type}"))
+            connection.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_minimadoc_content_hash ON minimadoc (content_hash)"
+            ))
 
     @staticmethod
     def delete_m_doc(fpath: str) -> None:
@@ -56,19 +71,83 @@ class MinimaStore(metaclass=Singleton):
             return doc
 
     @staticmethod
-    def find_removed_files(existing_file_paths: set[str]):
-        removed_files: list[str] = []
+    def update_content(fpath: str, content_hash: str | None, size: int | None) -> None:
         with Session(engine) as session:
-            statement = select(MinimaDoc)
-            results = session.exec(statement)
-            logger.debug(f"find_removed_files count found {results}")
-            for doc in results:
-                logger.debug(f"find_removed_files file {doc.fpath} checking to remove")
-                if doc.fpath not in existing_file_paths:
-                    logger.debug(f"find_removed_files file {doc.fpath} does not exist anymore, removing")
-                    removed_files.append(doc.fpath)
-        for fpath in removed_files:
-            MinimaStore.delete_m_doc(fpath)
+            doc = session.get(MinimaDoc, fpath)
+            if doc is None:
+                return
+            doc_update = MinimaDocUpdate(content_hash=content_hash, size=size)
+            doc.sqlmodel_update(doc_update.model_dump(exclude_unset=True))
+            session.add(doc)
+            session.commit()
+
+    @staticmethod
+    def reset_content(fpaths: list[str]) -> None:
+        # forgets the indexed state so the next crawl indexes the files again
+        with Session(engine) as session:
+            for i in range(0, len(fpaths), 500):
+                session.execute(
+                    update(MinimaDoc)
+                    .where(MinimaDoc.fpath.in_(fpaths[i:i + 500]))
+                    .values(content_hash=None, last_updated_seconds=None)
+                )
+            session.commit()
+
+    @staticmethod
+    def is_content_unchanged(fpath: str, content_hash: str, size: int) -> bool:
+        with Session(engine) as session:
+            doc = session.get(MinimaDoc, fpath)
+            return doc is not None and doc.content_hash == content_hash and doc.size == size
+
+    @staticmethod
+    def find_duplicate(fpath: str, content_hash: str, size: int) -> str | None:
+        with Session(engine) as session:
+            statement = select(MinimaDoc.fpath).where(
+                MinimaDoc.content_hash == content_hash,
+                MinimaDoc.size == size,
+                MinimaDoc.fpath != fpath
+            )
+            return session.exec(statement).first()
+
+    @staticmethod
+    def content_hashes(fpaths: list[str]) -> dict[str, str | None]:
+        # files that are not indexed, or are being reindexed, map to None
+        hashes: dict[str, str | None] = dict.fromkeys(fpaths)
+        with Session(engine) as session:
+            for i in range(0, len(fpaths), 500):
+                statement = select(MinimaDoc.fpath, MinimaDoc.content_hash).where(
+                    MinimaDoc.fpath.in_(fpaths[i:i + 500])
+                )
+                for fpath, content_hash in session.exec(statement):
+                    hashes[fpath] = content_hash
+        return hashes
+
+    @staticmethod
+    def load_snapshot() -> dict[str, int]:
+        with Session(engine) as session:
+            statement = select(MinimaDoc.fpath, MinimaDoc.last_updated_seconds)
+            return {fpath: last_updated_seconds for fpath, last_updated_seconds in session.exec(statement)}
+
+    @staticmethod
+    def find_removed_files(existing_file_paths: set[str]) -> list[str]:
+        # diff against a temp table so the comparison and the delete are one set-based transaction
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TEMP TABLE IF NOT EXISTS existing_path (fpath VARCHAR PRIMARY KEY)"))
+            connection.execute(text("DELETE FROM existing_path"))
+            if existing_file_paths:
+                connection.execute(
+                    text("INSERT OR IGNORE INTO existing_path (fpath) VALUES (:fpath)"),
+                    [{"fpath": fpath} for fpath in existing_file_paths]
+                )
+            removed_files: list[str] = list(connection.execute(text(
+                "SELECT fpath FROM minimadoc WHERE fpath NOT IN (SELECT fpath FROM existing_path)"
+            )).scalars())
+            if removed_files:
+                connection.execute(text(
+                    "DELETE FROM minimadoc WHERE fpath NOT IN (SELECT fpath FROM existing_path)"
+                ))
+            connection.execute(text("DROP TABLE existing_path"))
+        logger.debug(f"find_removed_files found {len(removed_files)} removed files")
         return removed_files
 
     @staticmethod
@@ -83,7 +162,7 @@ class MinimaStore(metaclass=Singleton):
                     logger.debug(
                         f"file {fpath} new last updated={last_updated_seconds} old last updated: {doc.last_updated_seconds}"
                     )
-                    if doc.last_updated_seconds < last_updated_seconds:
+                    if doc.last_updated_seconds is None or doc.last_updated_seconds < last_updated_seconds:
                         indexing_status = IndexingStatus.need_reindexing
                         logger.debug(f"file {fpath} needs indexing, timestamp changed")
                         doc_update = MinimaDocUpdate(fpath=fpath, last_updated_seconds=last_updated_seconds)
@@ -0,0 +1,206 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import PointStruct
+from sqlmodel import create_engine
+
+import storage
+from indexer import Config, Indexer
+from loaders import load_and_split
+from micro_batcher import MicroBatcher
+from vector_store import ExecutorAsyncClient, LockedClient
+from storage import IndexingStatus, MinimaStore
+
+PARAGRAPHS = [f"Paragraph {i} " + " ".join(f"word{i}_{j}" for j in range(80)) for i in range(6)]
+
+
+@pytest.fixture
+def indexer(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "engine", create_engine(f"sqlite:///{tmp_path / 'database.db'}"))
+    MinimaStore.create_db_and_tables()
+    indexer = Indexer.__new__(Indexer)
+    indexer.config = Config()
+    indexer.config.EMBEDDING_SIZE = 16
+    indexer.config.VECTOR_QUANTIZATION = "none"
+    indexer.config.CONTAINER_PATH = str(tmp_path)
+    indexer.config.LOCAL_FILES_PATH = "/files"
+    indexer.inference_executor = ThreadPoolExecutor(max_workers=1)
+    indexer.qdrant = LockedClient(QdrantClient(":memory:"))
+    indexer.async_qdrant = ExecutorAsyncClient(indexer.qdrant, indexer.inference_executor)
+    indexer.embed_model = DeterministicFakeEmbedding(size=16)
+    indexer.query_batcher = MicroBatcher(embed_many=indexer.embed_many, max_batch_size=8, max_wait_seconds=0.001)
+    indexer.lexical_index = None
+    indexer.retrieval_cache = None
+    indexer._active_queries = 0
+    indexer._queries_idle = threading.Condition()
+    indexer._pending_documents = []
+    indexer._pending_bytes = 0
+    indexer._pending_lock = threading.Lock()
+    indexer._store_lock = threading.Lock()
+    indexer._stored = threading.Condition(indexer._pending_lock)
+    indexer._storing = set()
+    indexer._next_batch = 0
+    indexer._unstored = {}
+    indexer._pending_content = {}
+    indexer._failed_paths = set()
+    indexer._in_flight = {}
+    indexer._followers = {}
+    indexer._setup_collection()
+    return indexer
+
+
+def index(indexer, path, last_updated_seconds):
+    message = {"path": str(path), "file_id": str(path), "last_updated_seconds": last_updated_seconds}
+    status = indexer.prepare(message)
+    if status not in (IndexingStatus.no_need_reindexing, IndexingStatus.duplicate):
+        indexer.store(message, load_and_split(str(path)))
+    indexer.flush()
+    return status
+
+
+def stored_contents(indexer, path):
+    points, _ = indexer.qdrant.scroll(
+        collection_name=indexer.config.QDRANT_COLLECTION,
+        limit=1024,
+        with_payload=True
+    )
+    return sorted(p.payload["page_content"] for p in points if str(path) in p.payload["fpath"])
+
+
+def test_identical_files_indexed_before_a_flush_share_chunks(indexer, tmp_path):
+    copies = [tmp_path / name for name in ("a.txt", "b.txt", "c.txt")]
+    for copy in copies:
+        copy.write_text("\n\n".join(PARAGRAPHS))
+    expected = sorted(doc.page_content for doc in load_and_split(str(copies[0])))
+
+    messages = [
+        {"path": str(copy), "file_id": str(copy), "last_updated_seconds": 1} for copy in copies[:2]
+    ]
+    assert [indexer.prepare(message) for message in messages] == [IndexingStatus.new_file, IndexingStatus.duplicate]
+    indexer.store(messages[0], load_and_split(str(copies[0])))
+    indexer.flush()
+    assert index(indexer, copies[2], 1) == IndexingStatus.duplicate
+
+    for copy in copies:
+        assert stored_contents(indexer, copy) == expected
+    assert len(indexer._point_ids(None)) == len(expected)
+    assert set(MinimaStore.content_hashes([str(copy) for copy in copies]).values()) == {messages[0]["content_hash"]}
+
+    indexer.remove_from_storage([str(copies[1])])
+    for copy in (copies[0], copies[2]):
+        assert stored_contents(indexer, copy) == expected
+
+
+def test_editing_original_keeps_duplicate_chunks(indexer, tmp_path):
+    original, duplicate = tmp_path / "a.txt", tmp_path / "b.txt"
+    original.write_text("\n\n".join(PARAGRAPHS))
+    duplicate.write_text("\n\n".join(PARAGRAPHS))
+    index(indexer, original, 1)
+    assert index(indexer, duplicate, 1) == IndexingStatus.duplicate
+    expected = sorted(doc.page_content for doc in load_and_split(str(duplicate)))
+
+    original.write_text("\n\n".join(PARAGRAPHS + ["An edited paragraph"]))
+    index(indexer, original, 2)
+
+    assert stored_contents(indexer, duplicate) == expected
+    assert stored_contents(indexer, original) == sorted(doc.page_content for doc in load_and_split(str(original)))
+
+    indexer.remove_from_storage([str(original)])
+    assert stored_contents(indexer, duplicate) == expected
+
+
+def test_new_file_at_removed_original_path_keeps_duplicate_chunks(indexer, tmp_path):
+    original, duplicate = tmp_path / "a.txt", tmp_path / "b.txt"
+    original.write_text("\n\n".join(PARAGRAPHS))
+    duplicate.write_text("\n\n".join(PARAGRAPHS))
+    index(indexer, original, 1)
+    index(indexer, duplicate, 1)
+    expected = sorted(doc.page_content for doc in load_and_split(str(duplicate)))
+
+    original.unlink()
+    indexer.purge({"existing_file_paths": [str(duplicate)]})
+    original.write_text("\n\n".join(PARAGRAPHS[:3]))
+    index(indexer, original, 3)
+
+    assert stored_contents(indexer, duplicate) == expected
+
+
+def test_failed_batch_is_reindexed_on_next_crawl(indexer, tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_text("\n\n".join(PARAGRAPHS))
+
+    class FailingEmbeddings:
+        def embed_documents(self, texts):
+            raise RuntimeError("embedding failed")
+
+    embed_model = indexer.embed_model
+    indexer.embed_model = FailingEmbeddings()
+    index(indexer, path, 1)
+    assert MinimaStore.load_snapshot() == {str(path): None}
+    assert MinimaStore.content_hashes([str(path)]) == {str(path): None}
+    assert stored_contents(indexer, path) == []
+
+    indexer.embed_model = embed_model
+    assert index(indexer, path, 1) == IndexingStatus.need_reindexing
+    assert MinimaStore.content_hashes([str(path)])[str(path)] is not None
+    assert stored_contents(indexer, path) == sorted(doc.page_content for doc in load_and_split(str(path)))
+
+
+def test_backfill_adds_filterable_payload_to_old_chunks(indexer, tmp_path):
+    path = tmp_path / "notes" / "a.txt"
+    indexer.qdrant.upsert(
+        collection_name=indexer.config.QDRANT_COLLECTION,
+        points=[PointStruct(
+            id="00000000-0000-0000-0000-000000000001",
+            vector=indexer.embed_model.embed_query("old chunk"),
+            payload={"page_content": "old chunk", "metadata": {"file_path": str(path)}}
+        )],
+        wait=True
+    )
+
+    indexer.backfill_payload()
+
+    points, _ = indexer.qdrant.scroll(
+        collection_name=indexer.config.QDRANT_COLLECTION,
+        scroll_filter=indexer.build_filter(file_type="txt", folder=str(tmp_path / "notes")),
+        with_payload=True
+    )
+    assert [point.payload["fpath"] for point in points] == [[str(path)]]
+
+
+def test_find_and_find_many_return_the_matching_file(indexer, tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_text("\n\n".join(PARAGRAPHS))
+    index(indexer, path, 1)
+    query = load_and_split(str(path))[0].page_content
+
+    async def search():
+        return await indexer.find(query, k=1), await indexer.find_many([query, query], k=1)
+
+    found, many = asyncio.run(search())
+    assert found["output"] == query
+    assert [result["output"] for result in many] == [query, query]
+
+
+def test_waiting_for_queries_does_not_block_queueing(indexer, tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_text("\n\n".join(PARAGRAPHS))
+    indexer.config.INDEXING_YIELD_SECONDS = 1
+    message = {"path": str(path), "file_id": str(path), "last_updated_seconds": 1}
+    indexer.prepare(message)
+    indexer.store(message, load_and_split(str(path)))
+
+    indexer._active_queries = 1
+    flushing = threading.Thread(target=indexer.flush)
+    flushing.start()
+    while not indexer._storing and flushing.is_alive():
+        time.sleep(0.001)
+    assert indexer._pending_lock.acquire(timeout=0.2)
+    indexer._pending_lock.release()
+    flushing.join()
+    assert stored_contents(indexer, path) == sorted(doc.page_content for doc in load_and_split(str(path)))
@@ -0,0 +1,23 @@
+import sqlite3
+
+import pytest
+
+from lexical_index import LexicalIndex
+
+
+def test_search_and_delete(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical.db"))
+    index.add([("a", "vpn policy for remote staff"), ("b", "quarterly revenue report")])
+    assert index.search("VPN policy", 5) == ["a"]
+
+    index.add([("a", "backup retention")])
+    index.delete(["b"])
+    assert index.search("vpn revenue", 5) == []
+    assert index.search("backup", 5) == ["a"]
+
+
+@pytest.mark.skipif(sqlite3.sqlite_version_info < (3, 43, 0), reason="needs contentless_delete")
+def test_chunk_text_is_not_stored(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical.db"))
+    index.add([("a", "vpn policy for remote staff")])
+    assert index._connection.execute("SELECT content FROM chunk").fetchall() == [(None,)]
@@ -0,0 +1,23 @@
+import os
+import subprocess
+import sys
+
+from loaders import load_and_split
+
+INDEXER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_loader_processes_do_not_import_the_embedding_stack():
+    imported = subprocess.run(
+        [sys.executable, "-c", "import sys, loaders; print(sorted({'torch', 'qdrant_client'} & set(sys.modules)))"],
+        cwd=INDEXER_DIR, capture_output=True, text=True, check=True
+    ).stdout.strip()
+    assert imported == "[]"
+
+
+def test_load_and_split_tags_chunks_with_their_file(tmp_path):
+    path = tmp_path / "notes.md"
+    path.write_text("\n\n".join("word " * 150 for _ in range(4)))
+    chunks = load_and_split(str(path))
+    assert len(chunks) > 1
+    assert {chunk.metadata["file_path"] for chunk in chunks} == {str(path)}
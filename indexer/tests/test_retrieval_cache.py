@@ -0,0 +1,27 @@
+import asyncio
+
+from retrieval_cache import RetrievalCache
+
+
+def test_cancelled_leader_does_not_cancel_collapsed_queries():
+    async def scenario():
+        cache = RetrievalCache(max_entries=8, ttl_seconds=60)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return ["result"]
+
+        leader = asyncio.create_task(cache.get_or_compute("query", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.get_or_compute("query", compute))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+
+        assert await follower == ["result"]
+        assert await cache.get_or_compute("query", compute) == ["result"]
+        assert len(calls) == 1
+        assert cache.collapsed == 1
+
+    asyncio.run(scenario())
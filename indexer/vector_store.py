@@ -0,0 +1,53 @@
+import asyncio
+import logging
+import threading
+from functools import partial
+from concurrent.futures import Executor
+
+from qdrant_client import QdrantClient, AsyncQdrantClient
+
+logger = logging.getLogger(__name__)
+
+
+# serializes calls to the embedded qdrant client shared by the index and query threads
+class LockedClient:
+
+    def __init__(self, client: QdrantClient):
+        self._client = client
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute):
+            return attribute
+
+        def locked(*args, **kwargs):
+            with self._lock:
+                return attribute(*args, **kwargs)
+        return locked
+
+
+# the embedded storage can only be opened once per process, so async calls reuse the sync client
+class ExecutorAsyncClient:
+
+    def __init__(self, client: LockedClient, executor: Executor):
+        self._client = client
+        self._executor = executor
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        async def run(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(method, *args, **kwargs))
+        return run
+
+
+def create_clients(backend: str, host: str, path: str, executor: Executor):
+    if backend == "qdrant":
+        return QdrantClient(host=host), AsyncQdrantClient(host=host)
+    if backend == "local":
+        logger.info(f"Using embedded vector storage at {path}")
+        client = LockedClient(QdrantClient(path=path))
+        return client, ExecutorAsyncClient(client, executor)
+    raise ValueError(f"Unsupported vector store backend: {backend}")
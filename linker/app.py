@@ -4,8 +4,10 @@ import asyncio
 import random
 import string
 from fastapi import FastAPI
-from requestor import request_data
+from requestor import request_data, close_client
 from contextlib import asynccontextmanager
+from task_processor import TaskProcessor
+from task_source import FirestoreTaskSource
 
 import json
 import requests
@@ -36,16 +38,21 @@ TASKS_COLLECTION = os.environ.get("TASKS_COLLECTION")
 USER_ID = os.environ.get("USER_ID")
 PASSWORD = os.environ.get("PASSWORD")
 FB_PROJECT = os.environ.get("FB_PROJECT")
+# "listener" gets pending tasks pushed, "query" polls the PENDING tasks only
+TASK_DELIVERY = os.environ.get("LINKER_TASK_DELIVERY", "listener")
+POLL_INTERVAL_SECONDS = float(os.environ.get("LINKER_POLL_INTERVAL_SECONDS", 2))
+CONCURRENCY = int(os.environ.get("LINKER_CONCURRENCY", 8))
+RETRY_SECONDS = float(os.environ.get("LINKER_RETRY_SECONDS", 5))
 
-app = FastAPI()
-response = sign_in_with_email_and_password(USER_ID, PASSWORD)
-creds = Credentials(response["idToken"], response["refreshToken"])
-# noinspection PyTypeChecker
-db = Client(FB_PROJECT, creds)
 
+def connect_firestore() -> Client:
+    response = sign_in_with_email_and_password(USER_ID, PASSWORD)
+    creds = Credentials(response["idToken"], response["refreshToken"])
+    # noinspection PyTypeChecker
+    return Client(FB_PROJECT, creds)
 
-async def poll_firestore():
-    logger.info(f"Polling Firestore collection: {COLLECTION_NAME}")
+
+def register_otp(db: Client) -> None:
     random_otp = ''.join(random.choices(string.ascii_uppercase + string.digits, k=16))
     doc_ref = db.collection(USERS_COLLECTION_NAME).document(USER_ID)
     try:
@@ -58,35 +65,31 @@ async def poll_firestore():
     else:
         doc_ref.create({'otp': random_otp})
     
-    while True:
-        print(f"OTP for this computer in Minima GPT: {random_otp}")
-        try:
-            docs = db.collection(COLLECTION_NAME).document(USER_ID).collection(TASKS_COLLECTION).stream()
-            for doc in docs:
-                data = doc.to_dict()
-                if data['status'] == 'PENDING':
-                    response = await request_data(data['request'])
-                    if 'error' not in response:
-                        logger.info(f"Updating Firestore document: {doc.id}")
-                        doc_ref = db.collection(COLLECTION_NAME).document(USER_ID).collection(TASKS_COLLECTION).document(doc.id)
-                        doc_ref.update({
-                            'status': 'COMPLETED',
-                            'links': response['result']['links'],
-                            'result': response['result']['output']
-                        })
-                    else:
-                        logger.error(f"Error in processing request: {response['error']}")
-            await asyncio.sleep(0.5)
-        except Exception as e:
-            logger.error(f"Error in polling Firestore collection: {e}")
-            await asyncio.sleep(0.5)
+    print(f"OTP for this computer in Minima GPT: {random_otp}")
+
+
+def create_task_source() -> FirestoreTaskSource:
+    db = connect_firestore()
+    register_otp(db)
+    logger.info(f"Watching Firestore collection: {COLLECTION_NAME}")
+    return FirestoreTaskSource(
+        db.collection(COLLECTION_NAME).document(USER_ID).collection(TASKS_COLLECTION),
+        mode=TASK_DELIVERY,
+        poll_interval_seconds=POLL_INTERVAL_SECONDS,
+        retry_seconds=RETRY_SECONDS,
+    )
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    logger.info("Starting Firestore polling")
-    poll_task = asyncio.create_task(poll_firestore())
+    logger.info(f"Starting linker with {TASK_DELIVERY} task delivery and {CONCURRENCY} concurrent requests")
+    source = await asyncio.to_thread(create_task_source)
+    await source.start()
+    processor_task = asyncio.create_task(TaskProcessor(source, request_data, CONCURRENCY).run())
     yield
-    poll_task.cancel()
+    processor_task.cancel()
+    await source.stop()
+    await close_client()
 
 
 def create_app() -> FastAPI:
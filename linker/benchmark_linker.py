@@ -0,0 +1,56 @@
+"""
+Measure linker throughput and latency against the indexer without Firestore.
+
+    python benchmark_linker.py --tasks 200 --concurrency 1 8 32
+
+Tasks come from the in-memory task source, the queries file holds one query per line.
+"""
+import time
+import random
+import asyncio
+import argparse
+
+from requestor import request_data
+from task_source import InMemoryTaskSource
+from task_processor import TaskProcessor
+
+
+def load_queries(path: str | None) -> list[str]:
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    return ["vpn policy", "q3 revenue", "backup retention", "server error codes", "invoice template"]
+
+
+async def run(queries: list[str], tasks: int, concurrency: int) -> None:
+    source = InMemoryTaskSource()
+    await source.start()
+    processor = TaskProcessor(source, request_data, concurrency=concurrency)
+    worker = asyncio.create_task(processor.run())
+    start = time.perf_counter()
+    added_at = {source.add(random.choice(queries)): time.perf_counter() for _ in range(tasks)}
+    await source.wait_for(tasks)
+    elapsed = time.perf_counter() - start
+    worker.cancel()
+    latencies = sorted(source.results[task_id]['completed_at'] - added for task_id, added in added_at.items())
+    print(
+        f"concurrency {concurrency:3d}: {tasks / elapsed:8.1f} tasks/s, "
+        f"p50 {latencies[len(latencies) // 2] * 1000:8.1f} ms, "
+        f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:8.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries-file")
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries_file)
+    for concurrency in args.concurrency:
+        asyncio.run(run(queries, args.tasks, concurrency))
+
+
+if __name__ == "__main__":
+    main()
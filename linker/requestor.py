@@ -1,4 +1,7 @@
+import os
+import time
 import httpx
+import random
 import logging
 import asyncio
 
@@ -11,21 +14,98 @@ REQUEST_HEADERS = {
     'Content-Type': 'application/json'
 }
 
-async def request_data(query):
+TIMEOUT_SECONDS = float(os.environ.get("INDEXER_TIMEOUT_SECONDS", 60))
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get("INDEXER_CONNECT_TIMEOUT_SECONDS", 5))
+MAX_CONNECTIONS = int(os.environ.get("INDEXER_MAX_CONNECTIONS", 32))
+MAX_RETRIES = int(os.environ.get("INDEXER_MAX_RETRIES", 3))
+RETRY_BACKOFF_SECONDS = float(os.environ.get("INDEXER_RETRY_BACKOFF_SECONDS", 0.5))
+BREAKER_FAILURES = int(os.environ.get("INDEXER_BREAKER_FAILURES", 5))
+BREAKER_RESET_SECONDS = float(os.environ.get("INDEXER_BREAKER_RESET_SECONDS", 30))
+
+
+# the breaker and retry loop are kept identical to mcp-server/src/mslocalrag/requestor.py,
+# the linker and the mcp server ship as separate packages and cannot share a module
+class CircuitBreaker:
+    """Fails fast after `failures` consecutive errors, then lets one trial request through every `reset_seconds`"""
+
+    def __init__(self, failures: int, reset_seconds: float):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._consecutive_failures = 0
+        self._opened_at: float | None = None
+        # only touched from the event loop, so unlike llm/indexer_client.py it needs no lock
+
+    def allow(self) -> bool:
+        if self._opened_at is None:
+            return True
+        if time.monotonic() - self._opened_at >= self.reset_seconds:
+            # half open, the next result closes or reopens the circuit
+            self._opened_at = time.monotonic()
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self._consecutive_failures = 0
+        self._opened_at = None
+
+    def record_failure(self) -> None:
+        self._consecutive_failures += 1
+        if self._consecutive_failures >= self.failures:
+            if self._opened_at is None:
+                logger.warning(f"Indexer failed {self._consecutive_failures} times, pausing requests")
+            self._opened_at = time.monotonic()
+
+
+_client: httpx.AsyncClient | None = None
+breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_RESET_SECONDS)
+
+
+def get_client() -> httpx.AsyncClient:
+    # one keep-alive connection pool for every request instead of a tcp handshake per query
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            headers=REQUEST_HEADERS,
+            timeout=httpx.Timeout(TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    if _client is not None:
+        await _client.aclose()
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+async def request_data(query, **filters):
     payload = {
-        "query": query
+        "query": query,
+        **{key: value for key, value in filters.items() if value is not None}
     }
-    async with httpx.AsyncClient() as client:
+    if not breaker.allow():
+        return {"error": f"Indexer is unavailable, retrying in up to {BREAKER_RESET_SECONDS:.0f} seconds"}
+    start = time.perf_counter()
+    for attempt in range(MAX_RETRIES + 1):
         try:
             logger.info(f"Requesting data from indexer with query: {query}")
-            response = await client.post(REQUEST_DATA_URL, 
-                                         headers=REQUEST_HEADERS, 
-                                         json=payload)
+            response = await get_client().post(REQUEST_DATA_URL, json=payload)
             response.raise_for_status()
             data = response.json()
-            logger.info(f"Received data: {data}")
+            breaker.record_success()
+            logger.info(f"Received data in {(time.perf_counter() - start) * 1000:.1f} ms: {data}")
             return data
 
         except Exception as e:
             logger.error(f"HTTP error: {e}")
-            return { "error": str(e) }
\ No newline at end of file
+            if not _is_retryable(e):
+                return {"error": str(e)}
+            if attempt == MAX_RETRIES:
+                breaker.record_failure()
+                return {"error": str(e)}
+            await asyncio.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt * (0.5 + random.random()))
@@ -0,0 +1,45 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from task_source import Task, TaskSource
+
+logger = logging.getLogger(__name__)
+
+
+class TaskProcessor:
+    """Answers the tasks of a source concurrently, with at most `concurrency` indexer requests in flight"""
+
+    def __init__(self, source: TaskSource, request_data: Callable[[str], Awaitable[dict]], concurrency: int = 8):
+        self.source = source
+        self.request_data = request_data
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._in_flight: set[str] = set()
+        self._running: set[asyncio.Task] = set()
+
+    async def run(self) -> None:
+        while True:
+            task = await self.source.next_task()
+            # a listener can deliver a task again before its completion is written back
+            if task.id in self._in_flight:
+                continue
+            await self._semaphore.acquire()
+            self._in_flight.add(task.id)
+            running = asyncio.create_task(self._process(task))
+            self._running.add(running)
+            running.add_done_callback(self._running.discard)
+
+    async def _process(self, task: Task) -> None:
+        try:
+            response = await self.request_data(task.request)
+            if 'error' not in response:
+                await self.source.complete(task, response['result']['links'], response['result']['output'])
+            else:
+                logger.error(f"Error in processing request: {response['error']}")
+                self.source.retry(task)
+        except Exception as e:
+            logger.error(f"Error in processing task {task.id}: {e}")
+            self.source.retry(task)
+        finally:
+            self._in_flight.discard(task.id)
+            self._semaphore.release()
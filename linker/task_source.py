@@ -0,0 +1,169 @@
+import time
+import asyncio
+import logging
+import itertools
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+logger = logging.getLogger(__name__)
+
+PENDING = "PENDING"
+COMPLETED = "COMPLETED"
+
+
+@dataclass
+class Task:
+    id: str
+    request: str
+
+
+class TaskSource(ABC):
+    """Delivers pending tasks to the linker and records their results"""
+
+    def __init__(self, retry_seconds: float = 5):
+        self.retry_seconds = retry_seconds
+        self._queue: asyncio.Queue[Task] | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+
+    async def stop(self) -> None:
+        pass
+
+    async def next_task(self) -> Task:
+        return await self._queue.get()
+
+    def _deliver(self, task: Task) -> None:
+        # safe to call from the threads Firestore runs its callbacks on
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, task)
+
+    def retry(self, task: Task) -> None:
+        self._loop.call_later(self.retry_seconds, self._queue.put_nowait, task)
+
+    @abstractmethod
+    async def complete(self, task: Task, links: list[str], result: str) -> None:
+        ...
+
+
+class FirestoreTaskSource(TaskSource):
+    """
+    Pending tasks of one user in Firestore
+
+    "listener" mode gets them pushed by a snapshot listener on the PENDING tasks,
+    "query" mode pages through the PENDING tasks with a cursor every poll interval.
+    """
+
+    def __init__(
+        self,
+        tasks_collection,
+        mode: str = "listener",
+        poll_interval_seconds: float = 2,
+        page_size: int = 100,
+        retry_seconds: float = 5,
+    ):
+        super().__init__(retry_seconds)
+        self.tasks_collection = tasks_collection
+        self.mode = mode
+        self.poll_interval_seconds = poll_interval_seconds
+        self.page_size = page_size
+        self.pending_query = tasks_collection.where(filter=FieldFilter("status", "==", PENDING))
+        self._watch = None
+        self._poll_task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        await super().start()
+        if self.mode == "listener":
+            logger.info("Listening for pending Firestore tasks")
+            self._watch = self.pending_query.on_snapshot(self._on_snapshot)
+        elif self.mode == "query":
+            logger.info(f"Querying pending Firestore tasks every {self.poll_interval_seconds}s")
+            self._poll_task = asyncio.create_task(self._poll())
+        else:
+            raise ValueError(f"Unsupported task delivery mode: {self.mode}")
+
+    async def stop(self) -> None:
+        if self._watch is not None:
+            self._watch.unsubscribe()
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+
+    def _on_snapshot(self, snapshot, changes, read_time) -> None:
+        for change in changes:
+            if change.type.name in ("ADDED", "MODIFIED"):
+                data = change.document.to_dict()
+                self._deliver(Task(id=change.document.id, request=data["request"]))
+
+    def _pending_page(self, last_document):
+        query = self.pending_query.order_by("__name__").limit(self.page_size)
+        if last_document is not None:
+            query = query.start_after(last_document)
+        return list(query.stream())
+
+    async def _poll(self) -> None:
+        while True:
+            try:
+                # tasks still waiting in the queue would only be queued twice
+                if not self._queue.empty():
+                    await asyncio.sleep(self.poll_interval_seconds)
+                    continue
+                last_document = None
+                while True:
+                    documents = await asyncio.to_thread(self._pending_page, last_document)
+                    for document in documents:
+                        self._queue.put_nowait(Task(id=document.id, request=document.to_dict()["request"]))
+                    if len(documents) < self.page_size:
+                        break
+                    last_document = documents[-1]
+            except Exception as e:
+                logger.error(f"Error in querying pending Firestore tasks: {e}")
+            await asyncio.sleep(self.poll_interval_seconds)
+
+    def retry(self, task: Task) -> None:
+        # a failed task is still PENDING, the next poll picks it up again
+        if self.mode == "listener":
+            super().retry(task)
+
+    async def complete(self, task: Task, links: list[str], result: str) -> None:
+        logger.info(f"Updating Firestore document: {task.id}")
+        await asyncio.to_thread(self.tasks_collection.document(task.id).update, {
+            'status': COMPLETED,
+            'links': links,
+            'result': result
+        })
+
+
+class InMemoryTaskSource(TaskSource):
+    """Local stand-in for Firestore, used to run and benchmark the linker offline"""
+
+    def __init__(self, retry_seconds: float = 5):
+        super().__init__(retry_seconds)
+        self.results: dict[str, dict] = {}
+        self._ids = itertools.count()
+        self._completed: asyncio.Condition | None = None
+
+    async def start(self) -> None:
+        await super().start()
+        self._completed = asyncio.Condition()
+
+    def add(self, request: str) -> str:
+        task = Task(id=str(next(self._ids)), request=request)
+        self._queue.put_nowait(task)
+        return task.id
+
+    async def complete(self, task: Task, links: list[str], result: str) -> None:
+        async with self._completed:
+            self.results[task.id] = {
+                'status': COMPLETED,
+                'links': links,
+                'result': result,
+                'completed_at': time.perf_counter()
+            }
+            self._completed.notify_all()
+
+    async def wait_for(self, count: int) -> None:
+        async with self._completed:
+            await self._completed.wait_for(lambda: len(self.results) >= count)
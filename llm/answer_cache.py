@@ -0,0 +1,134 @@
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Optional
+
+import numpy as np
+
+import indexer_client
+
+logger = logging.getLogger(__name__)
+
+FILES_STATE_PATH = "/files/state"
+
+
+def fetch_content_hashes(paths: Iterable[str]) -> Optional[dict[str, Optional[str]]]:
+    """Ask the indexer which content each file is currently indexed with, None when it cannot be reached"""
+    paths = list(paths)
+    if not paths:
+        return {}
+    data = indexer_client.post(FILES_STATE_PATH, {"paths": paths})
+    if "error" in data:
+        logger.error(f"Error in files state: {data['error']}")
+        return None
+    return data["result"]
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    vector: np.ndarray
+    answer: str
+    links: set
+    sources: dict[str, Optional[str]]
+
+
+class SemanticAnswerCache:
+    """
+    Bounded LRU cache of answers, looked up by cosine similarity of the question embedding
+
+    Every answer remembers the content hash of the files its context came from, a hit is only
+    served while the indexer still has all of them indexed with the same content.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        threshold: float,
+        content_hashes: Callable[[Iterable[str]], Optional[dict[str, Optional[str]]]] = fetch_content_hashes,
+    ):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.content_hashes = content_hashes
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._answers: OrderedDict[int, CachedAnswer] = OrderedDict()
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _closest(self, vector: np.ndarray) -> Optional[tuple[int, CachedAnswer]]:
+        with self._lock:
+            if not self._answers:
+                return None
+            keys = list(self._answers)
+            similarities = np.stack([self._answers[key].vector for key in keys]) @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            return keys[best], self._answers[keys[best]]
+
+    def lookup(self, vector: List[float]) -> Optional[CachedAnswer]:
+        closest = self._closest(self._normalize(vector))
+        if closest is not None:
+            key, cached = closest
+            current = self.content_hashes(cached.sources.keys())
+            if current is not None and all(
+                current.get(path) == content_hash for path, content_hash in cached.sources.items()
+            ):
+                with self._lock:
+                    if key in self._answers:
+                        self._answers.move_to_end(key)
+                    self.hits += 1
+                return cached
+            if current is not None:
+                # a source file was reindexed or removed since the answer was generated
+                self.invalidate_key(key)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def store(self, question: str, vector: List[float], answer: str, links: set, source_paths: Iterable[str]) -> None:
+        source_paths = set(source_paths)
+        if not source_paths:
+            # nothing to invalidate it with once matching files get indexed
+            return
+        sources = self.content_hashes(source_paths)
+        if sources is None or any(content_hash is None for content_hash in sources.values()):
+            # sources that are not fully indexed cannot be validated later
+            return
+        with self._lock:
+            self._answers[self._next_key] = CachedAnswer(
+                question=question,
+                vector=self._normalize(vector),
+                answer=answer,
+                links=set(links),
+                sources=sources,
+            )
+            self._next_key += 1
+            while len(self._answers) > self.max_size:
+                self._answers.popitem(last=False)
+
+    def invalidate_key(self, key: int) -> None:
+        with self._lock:
+            if self._answers.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> dict[str, any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._answers),
+            "max_entries": self.max_size,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -2,7 +2,7 @@ import logging
 import asyncio
 from fastapi import FastAPI
 from fastapi import WebSocket
-from llm_chain import LLMChain
+from llm_chain import get_llm_chain
 from async_queue import AsyncQueue
 
 import async_socket_to_chat
@@ -28,4 +28,10 @@ async def chat_client(websocket: WebSocket):
         answer_to_socket_promise,
         question_to_answer_promise,
         socket_to_chat_promise,
-    )
\ No newline at end of file
+    )
+
+
+@app.get("/llm/cache")
+async def answer_cache():
+    llm_chain = await asyncio.to_thread(get_llm_chain)
+    return {"result": llm_chain.answer_cache_stats()}
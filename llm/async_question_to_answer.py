@@ -1,24 +1,98 @@
+import os
+import uuid
 import json
+import asyncio
 import logging
-from llm_chain import LLMChain
+from llm_chain import LLMChain, get_llm_chain
 from async_queue import AsyncQueue
 import control_flow_commands as cfc
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("chat")
 
+STREAMING = os.environ.get("LLM_STREAMING", "true").lower() == "true"
+
+
+async def stream_answer(llm_chain: LLMChain, data: str, thread_id: str, response_queue: AsyncQueue):
+    async for event in llm_chain.astream(data, thread_id):
+        if event["type"] == "links":
+            response_queue.enqueue(
+                json.dumps({
+                    "reporter": "output_message",
+                    "type": "links",
+                    "message": "",
+                    "links": list(event["links"])
+                })
+            )
+        elif event["type"] == "answer_chunk":
+            response_queue.enqueue(
+                json.dumps({
+                    "reporter": "output_message",
+                    "type": "answer_chunk",
+                    "message": event["answer"],
+                })
+            )
+        elif event["type"] == "answer":
+            # the full answer replaces the merged chunks once generation is done
+            response_queue.enqueue(
+                json.dumps({
+                    "reporter": "output_message",
+                    "type": "full",
+                    "message": event["answer"],
+                    "links": list(event["links"]),
+                    "timings": event["timings"]
+                })
+            )
+        else:
+            response_queue.enqueue(
+                json.dumps({
+                    "reporter": "output_message",
+                    "type": "full",
+                    "message": f"Error: {event['error']}",
+                    "links": []
+                })
+            )
+
+
+async def answer(llm_chain: LLMChain, data: str, thread_id: str, response_queue: AsyncQueue):
+    result = await asyncio.to_thread(llm_chain.invoke, data, thread_id)
+    if "error" in result:
+        response_queue.enqueue(
+            json.dumps({
+                "reporter": "output_message",
+                "type": "answer",
+                "message": f"Error: {result['error']}",
+                "links": []
+            })
+        )
+        return
+    response_queue.enqueue(
+        json.dumps({
+            "reporter": "output_message",
+            "type": "answer",
+            "message": result["answer"],
+            "links": list(result["links"]),
+            "timings": result["timings"]
+        })
+    )
+
+
 async def loop(
         questions_queue: AsyncQueue,
         response_queue: AsyncQueue,
 ):
 
-    llm_chain = LLMChain()
+    # only the first session pays for loading the models, later ones reuse the shared chain
+    llm_chain = await asyncio.to_thread(get_llm_chain)
+    # one conversation per websocket, so follow-up questions see the earlier turns
+    thread_id = str(uuid.uuid4())
 
     while True:
         data = await questions_queue.dequeue()
         data = data.replace("\n", "")
 
         if data == cfc.CFC_CLIENT_DISCONNECTED:
+            llm_chain.end_conversation(thread_id)
             response_queue.enqueue(
                 json.dumps({
                     "reporter": "output_message",
@@ -44,12 +118,7 @@ async def loop(
             )
             
         elif data:
-            result = llm_chain.invoke(data)
-            response_queue.enqueue(
-                json.dumps({
-                    "reporter": "output_message",
-                    "type": "answer",
-                    "message": result["answer"],
-                    "links": list(result["links"])
-                })
-            )
\ No newline at end of file
+            if STREAMING:
+                await stream_answer(llm_chain, data, thread_id, response_queue)
+            else:
+                await answer(llm_chain, data, thread_id, response_queue)
\ No newline at end of file
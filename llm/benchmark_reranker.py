@@ -0,0 +1,93 @@
+"""
+Compare reranking latency and ranking agreement of the PyTorch and ONNX backends
+against the original HuggingFaceCrossEncoder reranker.
+
+    python benchmark_reranker.py --pairs-file pairs.tsv --candidates 10
+
+pairs.tsv holds one "query<TAB>chunk" per line, synthetic pairs are used without it.
+"""
+import time
+import random
+import argparse
+
+from langchain_community.cross_encoders.huggingface import HuggingFaceCrossEncoder
+
+from llm_chain import LLMConfig
+from reranker import create_cross_encoder
+
+
+def load_pairs(path: str | None, candidates: int) -> list[list[tuple[str, str]]]:
+    if path:
+        with open(path, encoding="utf-8") as f:
+            pairs = [tuple(line.rstrip("\n").split("\t", 1)) for line in f if "\t" in line]
+    else:
+        words = "vpn policy revenue quarter report invoice server error code backup retention".split()
+        pairs = [
+            (" ".join(random.sample(words, 3)), " ".join(random.choices(words, k=200)))
+            for _ in range(candidates * 20)
+        ]
+    return [pairs[i:i + candidates] for i in range(0, len(pairs), candidates)]
+
+
+def top_n(scores: list[float], n: int) -> set[int]:
+    return set(sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:n])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pairs-file")
+    parser.add_argument("--candidates", type=int, default=10)
+    parser.add_argument("--top-n", type=int, default=3)
+    args = parser.parse_args()
+
+    config = LLMConfig()
+    queries = load_pairs(args.pairs_file, args.candidates)
+    backends = {
+        "torch": dict(backend="torch"),
+        "onnx": dict(backend="onnx"),
+        "onnx int8": dict(backend="onnx", quantize=True),
+    }
+    # the reranker llm_chain used before the configurable backends, every backend is compared to it
+    cross_encoders = {
+        "original": lambda: HuggingFaceCrossEncoder(
+            model_name=config.rerank_model,
+            model_kwargs={'device': config.device},
+        ),
+    }
+    for name, options in backends.items():
+        cross_encoders[name] = lambda options=options: create_cross_encoder(
+            model_name=config.rerank_model,
+            device=config.device,
+            max_length=config.rerank_max_length,
+            truncation=config.rerank_truncation,
+            batch_size=config.rerank_batch_size,
+            **options,
+        )
+    baseline = None
+    for name, load in cross_encoders.items():
+        try:
+            cross_encoder = load()
+        except ImportError as e:
+            print(f"{name:>10}: skipped, {e}")
+            continue
+        cross_encoder.score(queries[0])
+        latencies, results = [], []
+        for pairs in queries:
+            start = time.perf_counter()
+            results.append(list(cross_encoder.score(pairs)))
+            latencies.append(time.perf_counter() - start)
+        baseline = baseline or results
+        agreement = sum(
+            len(top_n(scores, args.top_n) & top_n(expected, args.top_n)) / args.top_n
+            for scores, expected in zip(results, baseline)
+        ) / len(results)
+        latencies.sort()
+        print(
+            f"{name:>10}: p50={latencies[len(latencies) // 2] * 1000:.1f}ms "
+            f"p99={latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.1f}ms "
+            f"top{args.top_n} agreement with original={agreement:.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.memory import MemorySaver
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    In-memory checkpointer that only keeps the latest checkpoint of each thread
+    and evicts threads that were idle longer than the TTL or exceed the LRU capacity
+
+    Works on the storage, writes and blobs of MemorySaver, keep langgraph-checkpoint
+    pinned in requirements.txt and run tests/test_checkpointer.py when upgrading it.
+    """
+
+    def __init__(self, max_threads: int = 256, ttl_seconds: float = 3600, **kwargs):
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self.ttl_seconds = ttl_seconds
+        self._last_used: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get_tuple(self, config: RunnableConfig):
+        with self._lock:
+            self._touch(config["configurable"]["thread_id"])
+            return super().get_tuple(config)
+
+    def put(self, config: RunnableConfig, checkpoint, metadata, new_versions):
+        with self._lock:
+            thread_id = config["configurable"]["thread_id"]
+            self._touch(thread_id)
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            self._prune(
+                thread_id,
+                next_config["configurable"].get("checkpoint_ns", ""),
+                next_config["configurable"]["checkpoint_id"],
+            )
+            return next_config
+
+    def put_writes(self, config: RunnableConfig, writes, task_id: str, *args, **kwargs) -> None:
+        with self._lock:
+            super().put_writes(config, writes, task_id, *args, **kwargs)
+
+    def delete_thread(self, thread_id: str) -> None:
+        """Drop every checkpoint, pending write and stored value of a thread"""
+        with self._lock:
+            self._last_used.pop(thread_id, None)
+            self.storage.pop(thread_id, None)
+            for key in [key for key in self.writes if key[0] == thread_id]:
+                del self.writes[key]
+            blobs = getattr(self, "blobs", None)
+            if blobs is not None:
+                for key in [key for key in blobs if key[0] == thread_id]:
+                    del blobs[key]
+
+    def _touch(self, thread_id: str) -> None:
+        now = time.monotonic()
+        self._last_used[thread_id] = now
+        self._last_used.move_to_end(thread_id)
+        expired = [
+            key for key, last_used in self._last_used.items()
+            if key != thread_id and now - last_used > self.ttl_seconds
+        ]
+        overflow = len(self._last_used) - len(expired) - self.max_threads
+        if overflow > 0:
+            expired.extend(
+                [key for key in self._last_used if key != thread_id and key not in expired][:overflow]
+            )
+        for key in expired:
+            self.delete_thread(key)
+        if expired:
+            logger.info(f"Evicted {len(expired)} conversation(s) from the checkpointer")
+
+    def _prune(self, thread_id: str, checkpoint_ns: str, checkpoint_id: Optional[str]) -> None:
+        # the graph never goes back in time, older checkpoints of a thread are dead weight
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        for key in [key for key in checkpoints if key != checkpoint_id]:
+            del checkpoints[key]
+            self.writes.pop((thread_id, checkpoint_ns, key), None)
+        blobs = getattr(self, "blobs", None)
+        if blobs is None:
+            return
+        # channel versions only grow, so the latest checkpoint references the newest version of each channel
+        newest: dict[str, tuple] = {}
+        stale = []
+        for key in blobs:
+            if key[0] != thread_id or key[1] != checkpoint_ns:
+                continue
+            current = newest.get(key[2])
+            if current is None:
+                newest[key[2]] = key
+            elif key[3] > current[3]:
+                newest[key[2]] = key
+                stale.append(current)
+            else:
+                stale.append(key)
+        for key in stale:
+            del blobs[key]
@@ -0,0 +1,109 @@
+import os
+import time
+import logging
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+INDEXER_URL = os.environ.get("INDEXER_URL", "http://indexer:8000")
+REQUEST_HEADERS = {
+    'Accept': 'application/json',
+    'Content-Type': 'application/json'
+}
+
+TIMEOUT_SECONDS = float(os.environ.get("INDEXER_TIMEOUT_SECONDS", 60))
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get("INDEXER_CONNECT_TIMEOUT_SECONDS", 5))
+MAX_CONNECTIONS = int(os.environ.get("INDEXER_MAX_CONNECTIONS", 32))
+MAX_RETRIES = int(os.environ.get("INDEXER_MAX_RETRIES", 3))
+RETRY_BACKOFF_SECONDS = float(os.environ.get("INDEXER_RETRY_BACKOFF_SECONDS", 0.5))
+BREAKER_FAILURES = int(os.environ.get("INDEXER_BREAKER_FAILURES", 5))
+BREAKER_RESET_SECONDS = float(os.environ.get("INDEXER_BREAKER_RESET_SECONDS", 30))
+
+
+class CircuitBreaker:
+    """Fails fast after `failures` consecutive errors, then lets one trial request through every `reset_seconds`"""
+
+    def __init__(self, failures: int, reset_seconds: float):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        # the session is shared by the embeddings, the retriever and the answer cache threads,
+        # so the half open check must let exactly one of them through
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_seconds:
+                # half open, the next result closes or reopens the circuit
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._consecutive_failures = 0
+            self._opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self.failures:
+                if self._opened_at is None:
+                    logger.warning(f"Indexer failed {self._consecutive_failures} times, pausing requests")
+                self._opened_at = time.monotonic()
+
+
+def _create_session() -> requests.Session:
+    # one keep-alive connection pool shared by the embeddings, the retriever and the answer cache
+    session = requests.Session()
+    session.headers.update(REQUEST_HEADERS)
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=RETRY_BACKOFF_SECONDS,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=None,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONNECTIONS, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+session = _create_session()
+breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_RESET_SECONDS)
+
+
+def post(path: str, payload: dict) -> dict:
+    """POST to the indexer, returns the decoded response or {"error": ...}"""
+    if not breaker.allow():
+        return {"error": f"Indexer is unavailable, retrying in up to {BREAKER_RESET_SECONDS:.0f} seconds"}
+    start = time.perf_counter()
+    try:
+        response = session.post(
+            f"{INDEXER_URL}{path}",
+            json=payload,
+            timeout=(CONNECT_TIMEOUT_SECONDS, TIMEOUT_SECONDS)
+        )
+        response.raise_for_status()
+        data = response.json()
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        breaker.record_failure()
+        logger.error(f"HTTP error: {e}")
+        return {"error": str(e)}
+    except requests.exceptions.RequestException as e:
+        if e.response is not None and e.response.status_code >= 500:
+            breaker.record_failure()
+        logger.error(f"HTTP error: {e}")
+        return {"error": str(e)}
+    breaker.record_success()
+    logger.debug(f"Indexer {path} answered in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return data
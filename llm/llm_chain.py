@@ -1,29 +1,36 @@
 import os
+import time
 import uuid
+import asyncio
 import torch
 import datetime
 import logging
+import threading
 from dataclasses import dataclass
-from typing import Sequence, Optional
+from typing import AsyncIterator, Iterable, Sequence, Optional
 from langchain.schema import Document
 from qdrant_client import QdrantClient
 from langchain_ollama import ChatOllama
-from minima_embed import MinimaEmbeddings
+from minima_embed import create_embeddings
+from langchain_core.embeddings import Embeddings
+from minima_retriever import MinimaRetriever
 from langgraph.graph import START, StateGraph
 from langchain_qdrant import QdrantVectorStore
 from langchain_core.messages import BaseMessage
 from langgraph.graph.message import add_messages
 from typing_extensions import Annotated, TypedDict
-from langgraph.checkpoint.memory import MemorySaver
 from langchain_core.pydantic_v1 import BaseModel, Field
-from langchain_core.messages import AIMessage, HumanMessage
-from langchain.chains.retrieval import create_retrieval_chain
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, SystemMessage
+from langchain_core.runnables import RunnableLambda
 from langchain.retrievers import ContextualCompressionRetriever
 from langchain.retrievers.document_compressors import CrossEncoderReranker
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_community.cross_encoders.huggingface import HuggingFaceCrossEncoder
-from langchain.chains.history_aware_retriever import create_history_aware_retriever
+from reranker import create_cross_encoder
+from checkpointer import BoundedMemorySaver
+from langchain_core.output_parsers import StrOutputParser
+from query_cache import QueryCache
+from answer_cache import SemanticAnswerCache
 
 logger = logging.getLogger(__name__)
 
@@ -54,6 +61,27 @@ QUERY_ENHANCEMENT_PROMPT = (
     "Do not change the original meaning of the question and do not add any additional information."
 )
 
+MERGED_QUERY_PROMPT = (
+    "You are an expert at converting user questions into queries."
+    "You have access to a users files."
+    "Given a chat history and the latest user question which might reference context in the chat history, "
+    "write one standalone expanded query which can be understood without the chat history."
+    "Just return the query, do not answer the question and do not add any other text."
+    "If there are acronyms or words you are not familiar with, do not try to rephrase them."
+    "Do not change the original meaning of the question and do not add any additional information."
+)
+
+HISTORY_SUMMARY_PROMPT = (
+    "Summarize the conversation between the user and the assistant so far. "
+    "Extend the existing summary with the new lines of conversation. "
+    "Keep names, facts and open questions, and return only the summary."
+)
+
+# names used to pick the reranked documents and the answer tokens out of the streamed events,
+# a run name is not inherited by the base retriever the way a tag would be
+RETRIEVAL_RUN_NAME = "minima_retrieval"
+ANSWER_TAG = "minima_answer"
+
 class ParaphrasedQuery(BaseModel):
     paraphrased_query: str = Field(
         ...,
@@ -65,10 +93,34 @@ class LLMConfig:
     """Configuration settings for the LLM Chain"""
     qdrant_collection: str = "mnm_storage"
     qdrant_host: str = "qdrant"
+    vector_store: str = os.environ.get("VECTOR_STORE", "qdrant")
+    # "http" embeds queries through the indexer, "local" runs the indexer's model in-process
+    embedding_provider: str = os.environ.get("EMBEDDING_PROVIDER", "http")
+    embedding_model: str = os.environ.get("EMBEDDING_MODEL_ID")
+    embedding_verify: bool = os.environ.get("EMBEDDING_VERIFY", "true").lower() == "true"
+    hybrid_search: bool = os.environ.get("HYBRID_SEARCH", "false").lower() == "true"
     ollama_url: str = "http://ollama:11434"
     ollama_model: str = os.environ.get("OLLAMA_MODEL")
     rerank_model: str = os.environ.get("RERANKER_MODEL")
+    rerank_backend: str = os.environ.get("RERANKER_BACKEND", "torch")
+    rerank_quantize: bool = os.environ.get("RERANKER_QUANTIZE", "false").lower() == "true"
+    rerank_max_length: int = int(os.environ.get("RERANKER_MAX_LENGTH", 512))
+    rerank_truncation: str = os.environ.get("RERANKER_TRUNCATION", "only_second")
+    rerank_batch_size: int = int(os.environ.get("RERANKER_BATCH_SIZE", 16))
+    rerank_cache_size: int = int(os.environ.get("RERANKER_CACHE_SIZE", 4096))
+    rerank_pool_size: int = int(os.environ.get("RERANKER_POOL_SIZE", 1))
     temperature: float = 0.5
+    # sequential: expand the question, then contextualize it against the history when there is one
+    # merged: a single call expands and contextualizes, off: only contextualize when there is history
+    retrieval_planning: str = os.environ.get("LLM_RETRIEVAL_PLANNING", "sequential")
+    query_cache_size: int = int(os.environ.get("LLM_QUERY_CACHE_SIZE", 1024))
+    answer_cache: bool = os.environ.get("LLM_ANSWER_CACHE", "false").lower() == "true"
+    answer_cache_size: int = int(os.environ.get("LLM_ANSWER_CACHE_SIZE", 512))
+    answer_cache_threshold: float = float(os.environ.get("LLM_ANSWER_CACHE_THRESHOLD", 0.95))
+    history_turns: int = int(os.environ.get("LLM_HISTORY_TURNS", 5))
+    history_summary: bool = os.environ.get("LLM_HISTORY_SUMMARY", "false").lower() == "true"
+    max_sessions: int = int(os.environ.get("LLM_MAX_SESSIONS", 256))
+    session_ttl_seconds: float = float(os.environ.get("LLM_SESSION_TTL_SECONDS", 3600))
     device: torch.device = torch.device(
         "mps" if torch.backends.mps.is_available() else
         "cuda" if torch.cuda.is_available() else
@@ -89,6 +141,9 @@ class State(TypedDict):
     context: str
     answer: str
     init_query: str
+    retrieval_query: str
+    summary: str
+    timings: dict
 
 
 class LLMChain:
@@ -99,8 +154,15 @@ class LLMChain:
         self.localConfig = LocalConfig()
         self.config = config or LLMConfig()
         self.llm = self._setup_llm()
+        self.embeddings = self._setup_embeddings()
         self.document_store = self._setup_document_store()
-        self.chain = self._setup_chain()
+        self.query_cache = QueryCache(self.config.query_cache_size)
+        self.answer_cache = self._setup_answer_cache()
+        self._setup_chain()
+        self.checkpointer = BoundedMemorySaver(
+            max_threads=self.config.max_sessions,
+            ttl_seconds=self.config.session_ttl_seconds,
+        )
         self.graph = self._create_graph()
 
     def _setup_llm(self) -> ChatOllama:
@@ -111,38 +173,84 @@ class LLMChain:
             temperature=self.config.temperature
         )
 
-    def _setup_document_store(self) -> QdrantVectorStore:
+    def _uses_indexer_retrieval(self) -> bool:
+        # the indexer owns the embedded vector storage and the lexical index, retrieval goes through its API
+        return self.config.vector_store == "local" or self.config.hybrid_search
+
+    def _setup_embeddings(self) -> Optional[Embeddings]:
+        """Initialize the query embeddings, only needed when this service embeds queries itself"""
+        if self._uses_indexer_retrieval() and not self.config.answer_cache:
+            return None
+        return create_embeddings(
+            provider=self.config.embedding_provider,
+            model_name=self.config.embedding_model,
+            device=self.config.device,
+            verify=self.config.embedding_verify,
+        )
+
+    def _setup_document_store(self) -> Optional[QdrantVectorStore]:
         """Initialize the document store with vector embeddings"""
+        if self._uses_indexer_retrieval():
+            return None
         qdrant = QdrantClient(host=self.config.qdrant_host)
-        embed_model = MinimaEmbeddings()
         return QdrantVectorStore(
             client=qdrant,
             collection_name=self.config.qdrant_collection,
-            embedding=embed_model
+            embedding=self.embeddings
+        )
+
+    def _setup_answer_cache(self) -> Optional[SemanticAnswerCache]:
+        """Initialize the semantic answer cache, looked up with the query embeddings"""
+        if not self.config.answer_cache:
+            return None
+        return SemanticAnswerCache(
+            max_size=self.config.answer_cache_size,
+            threshold=self.config.answer_cache_threshold,
         )
 
     def _setup_chain(self):
         """Set up the retrieval and QA chain"""
         # Initialize retriever with reranking
-        base_retriever = self.document_store.as_retriever()
-        reranker = HuggingFaceCrossEncoder(
+        if self.document_store is None:
+            base_retriever = MinimaRetriever()
+        else:
+            base_retriever = self.document_store.as_retriever()
+        reranker = create_cross_encoder(
             model_name=self.config.rerank_model,
-            model_kwargs={'device': self.config.device},
+            device=self.config.device,
+            backend=self.config.rerank_backend,
+            quantize=self.config.rerank_quantize,
+            max_length=self.config.rerank_max_length,
+            truncation=self.config.rerank_truncation,
+            batch_size=self.config.rerank_batch_size,
+            cache_size=self.config.rerank_cache_size,
+            pool_size=self.config.rerank_pool_size,
         )
-        compression_retriever = ContextualCompressionRetriever(
+        self.retriever = ContextualCompressionRetriever(
             base_compressor=CrossEncoderReranker(model=reranker, top_n=3),
             base_retriever=base_retriever
-        )
+        ).with_config(run_name=RETRIEVAL_RUN_NAME)
 
-        # Create history-aware retriever
+        # Create the query rewriting steps
         contextualize_prompt = ChatPromptTemplate.from_messages([
             ("system", CONTEXTUALIZE_Q_SYSTEM_PROMPT),
             MessagesPlaceholder("chat_history"),
             ("human", "{input}"),
         ])
-        history_aware_retriever = create_history_aware_retriever(
-            self.llm, compression_retriever, contextualize_prompt
-        )
+        enhancement_prompt = ChatPromptTemplate.from_messages([
+            ("system", QUERY_ENHANCEMENT_PROMPT),
+            ("human", "{input}"),
+        ])
+        merged_prompt = ChatPromptTemplate.from_messages([
+            ("system", MERGED_QUERY_PROMPT),
+            MessagesPlaceholder("chat_history"),
+            ("human", "{input}"),
+        ])
+        self.rewriters = {
+            "enhance": enhancement_prompt | self.llm | StrOutputParser(),
+            "contextualize": contextualize_prompt | self.llm | StrOutputParser(),
+            "merge": merged_prompt | self.llm | StrOutputParser(),
+        }
 
         # Create QA chain
         qa_prompt = ChatPromptTemplate.from_messages([
@@ -150,41 +258,114 @@ class LLMChain:
             MessagesPlaceholder("chat_history"),
             ("human", "{input}"),
         ])
-        qa_chain = create_stuff_documents_chain(self.llm, qa_prompt)
-        retrieval_chain = create_retrieval_chain(history_aware_retriever, qa_chain)
-
-        return retrieval_chain
+        self.qa_chain = create_stuff_documents_chain(self.llm.with_config(tags=[ANSWER_TAG]), qa_prompt)
 
     def _create_graph(self) -> StateGraph:
         """Create the processing graph"""
         workflow = StateGraph(state_schema=State)
-        workflow.add_node("enhance", self._enhance_query)
-        workflow.add_node("retrieval", self._call_model)
+        workflow.add_node("enhance", RunnableLambda(self._plan_query, afunc=self._aplan_query))
+        workflow.add_node("retrieval", RunnableLambda(self._call_model, afunc=self._acall_model))
+        workflow.add_node("memory", RunnableLambda(self._trim_history, afunc=self._atrim_history))
         workflow.add_edge(START, "enhance")
         workflow.add_edge("enhance", "retrieval")
-        return workflow.compile(checkpointer=MemorySaver())
+        workflow.add_edge("retrieval", "memory")
+        return workflow.compile(checkpointer=self.checkpointer)
 
-    def _enhance_query(self, state: State) -> str:
-        """Enhance the query using the LLM"""
-        prompt_enhancement = ChatPromptTemplate.from_messages([
-            ("system", QUERY_ENHANCEMENT_PROMPT),
-            ("human", "{input}"),
-        ])
-        query_enhancement = prompt_enhancement | self.llm
-        enhanced_query = query_enhancement.invoke({
-            "input": state["input"]
-        })
-        logger.info(f"Enhanced query: {enhanced_query}")
-        state["init_query"] = state["input"]
-        state["input"] = enhanced_query.content
-        return state
+    def _planned_steps(self, history: list) -> list:
+        mode = self.config.retrieval_planning
+        if mode == "sequential":
+            # there is nothing to contextualize against on the first turn
+            return ["enhance", "contextualize"] if history else ["enhance"]
+        if mode == "merged":
+            return ["merge"] if history else ["enhance"]
+        if mode == "off":
+            return ["contextualize"] if history else []
+        raise ValueError(f"Unsupported retrieval planning mode: {mode}")
+
+    def _rewrite(self, step: str, query: str, history: list) -> str:
+        key = self.query_cache.key(step, query, history)
+        rewritten = self.query_cache.get(key)
+        if rewritten is None:
+            rewritten = self.rewriters[step].invoke({"input": query, "chat_history": history})
+            self.query_cache.put(key, rewritten)
+        return rewritten
+
+    async def _arewrite(self, step: str, query: str, history: list) -> str:
+        key = self.query_cache.key(step, query, history)
+        rewritten = self.query_cache.get(key)
+        if rewritten is None:
+            rewritten = await self.rewriters[step].ainvoke({"input": query, "chat_history": history})
+            self.query_cache.put(key, rewritten)
+        return rewritten
+
+    def _plan_query(self, state: State) -> dict:
+        """Rewrite the question into the retrieval query with as few LLM calls as the mode allows"""
+        start = time.perf_counter()
+        history = self._history(state)
+        answer_input = query = state["input"]
+        for step in self._planned_steps(history):
+            query = self._rewrite(step, query, history)
+            if step != "contextualize":
+                answer_input = query
+        return self._planned_state(state, answer_input, query, start)
+
+    async def _aplan_query(self, state: State) -> dict:
+        """Rewrite the question into the retrieval query without blocking the event loop"""
+        start = time.perf_counter()
+        history = self._history(state)
+        answer_input = query = state["input"]
+        for step in self._planned_steps(history):
+            query = await self._arewrite(step, query, history)
+            if step != "contextualize":
+                answer_input = query
+        return self._planned_state(state, answer_input, query, start)
+
+    def _planned_state(self, state: State, answer_input: str, query: str, start: float) -> dict:
+        logger.info(f"Enhanced query: {answer_input}")
+        logger.info(f"Retrieval query: {query}")
+        return {
+            "init_query": state["input"],
+            "input": answer_input,
+            "retrieval_query": query,
+            "timings": {"planning": time.perf_counter() - start},
+        }
 
     def _call_model(self, state: State) -> dict:
         """Process the query through the model"""
         logger.info(f"Processing query: {state['init_query']}")
-        logger.info(f"Enhanced query: {state['input']}")
-        response = self.chain.invoke(state)
+        start = time.perf_counter()
+        context = self.retriever.invoke(state["retrieval_query"])
+        retrieved = time.perf_counter()
+        answer = self.qa_chain.invoke(self._qa_input(state, context))
+        return self._model_state(state, {"answer": answer, "context": context}, start, retrieved)
+
+    async def _acall_model(self, state: State) -> dict:
+        """Process the query through the model without blocking the event loop"""
+        logger.info(f"Processing query: {state['init_query']}")
+        start = time.perf_counter()
+        context = await self.retriever.ainvoke(state["retrieval_query"])
+        retrieved = time.perf_counter()
+        answer = await self.qa_chain.ainvoke(self._qa_input(state, context))
+        return self._model_state(state, {"answer": answer, "context": context}, start, retrieved)
+
+    def _history(self, state: State) -> list:
+        # the summary of trimmed turns goes in front of the history the prompts see
+        history = list(state.get("chat_history", []))
+        if state.get("summary"):
+            history.insert(0, SystemMessage(f"Summary of the earlier conversation: {state['summary']}"))
+        return history
+
+    def _qa_input(self, state: State, context: list) -> dict:
+        return {"input": state["input"], "chat_history": self._history(state), "context": context}
+
+    def _model_state(self, state: State, response: dict, start: float, retrieved: float) -> dict:
         logger.info(f"Received response: {response['answer']}")
+        timings = {
+            **state.get("timings", {}),
+            "retrieval": retrieved - start,
+            "generation": time.perf_counter() - retrieved,
+        }
+        logger.info("Stage timings: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()))
         return {
             "chat_history": [
                 HumanMessage(state["init_query"]),
@@ -192,40 +373,216 @@ class LLMChain:
             ],
             "context": response["context"],
             "answer": response["answer"],
+            "timings": timings,
         }
     
-    def invoke(self, message: str) -> dict:
+    def _history_overflow(self, state: State) -> list:
+        history = list(state.get("chat_history", []))
+        keep = max(self.config.history_turns, 0) * 2
+        return history[:len(history) - keep]
+
+    def _summarization(self):
+        prompt_summary = ChatPromptTemplate.from_messages([
+            ("system", HISTORY_SUMMARY_PROMPT),
+            ("human", "Existing summary: {summary}\n\nNew lines of conversation:\n{conversation}"),
+        ])
+        return prompt_summary | self.llm
+
+    def _summary_input(self, state: State, removed: list) -> dict:
+        conversation = "\n".join(
+            f"{'User' if isinstance(message, HumanMessage) else 'Assistant'}: {message.content}"
+            for message in removed
+        )
+        return {"summary": state.get("summary") or "none", "conversation": conversation}
+
+    def _trim_history(self, state: State) -> dict:
+        """Keep the last history_turns turns, optionally folding older ones into the summary"""
+        removed = self._history_overflow(state)
+        summary = state.get("summary", "")
+        if removed and self.config.history_summary:
+            summary = self._summarization().invoke(self._summary_input(state, removed)).content
+        return self._trimmed_state(removed, summary)
+
+    async def _atrim_history(self, state: State) -> dict:
+        """Trim the history without blocking the event loop"""
+        removed = self._history_overflow(state)
+        summary = state.get("summary", "")
+        if removed and self.config.history_summary:
+            summary = (await self._summarization().ainvoke(self._summary_input(state, removed))).content
+        return self._trimmed_state(removed, summary)
+
+    def _trimmed_state(self, removed: list, summary: str) -> dict:
+        if removed:
+            logger.info(f"Trimmed {len(removed)} message(s) from the chat history")
+        return {
+            "chat_history": [RemoveMessage(id=message.id) for message in removed],
+            "summary": summary,
+        }
+
+    def _run_config(self, thread_id: Optional[str] = None) -> dict:
+        return {
+            "configurable": {
+                "thread_id": thread_id or str(uuid.uuid4()),
+                "thread_ts": datetime.datetime.now().isoformat()
+            }
+        }
+
+    def _links(self, documents: Iterable[Document]) -> set:
+        links = set()
+        for doc in documents:
+            path = doc.metadata["file_path"].replace(
+                self.localConfig.CONTAINER_PATH,
+                self.localConfig.LOCAL_FILES_PATH
+            )
+            links.add(f"file://{path}")
+        return links
+
+    def invoke(self, message: str, thread_id: Optional[str] = None) -> dict:
         """
         Process a user message and return the response
         
         Args:
             message: The user's input message
+            thread_id: Conversation the message belongs to, a one-off conversation if omitted
             
         Returns:
             dict: Contains the model's response or error information
         """
         try:
             logger.info(f"Processing query: {message}")
-            config = {
-                "configurable": {
-                    "thread_id": uuid.uuid4(),
-                    "thread_ts": datetime.datetime.now().isoformat()
-                }   
-            }
+            config = self._run_config(thread_id)
+            start = time.perf_counter()
+            cached, vector = self._lookup_answer(message, config)
+            if cached is not None:
+                return {"answer": cached.answer, "links": cached.links, "timings": self._cache_timings(start)}
             result = self.graph.invoke(
                 {"input": message},
                 config=config
             )
             logger.info(f"OUTPUT: {result}")
-            links = set()
-            for ctx in result["context"]:
-                doc: Document = ctx
-                path = doc.metadata["file_path"].replace(
-                    self.localConfig.CONTAINER_PATH,
-                    self.localConfig.LOCAL_FILES_PATH
-                )
-                links.add(f"file://{path}")
-            return {"answer": result["answer"], "links": links}
+            links = self._links(result["context"])
+            self._store_answer(message, vector, result["answer"], links, result["context"])
+            return {
+                "answer": result["answer"],
+                "links": links,
+                "timings": result.get("timings", {}),
+            }
         except Exception as e:
             logger.error(f"Error processing query", exc_info=True)
-            return {"error": str(e), "status": "error"}
\ No newline at end of file
+            return {"error": str(e), "status": "error"}
+
+    async def astream(self, message: str, thread_id: Optional[str] = None) -> AsyncIterator[dict]:
+        """
+        Process a user message and stream the response as it is produced
+
+        Args:
+            message: The user's input message
+            thread_id: Conversation the message belongs to, a one-off conversation if omitted
+
+        Yields:
+            dict: "links" once retrieval and reranking finished, "answer_chunk" per generated
+            token, then "answer" with the whole answer, links and stage timings, or "error"
+        """
+        try:
+            logger.info(f"Streaming query: {message}")
+            links = set()
+            answer = []
+            config = self._run_config(thread_id)
+            start = time.perf_counter()
+            cached, vector = await asyncio.to_thread(self._lookup_answer, message, config)
+            if cached is not None:
+                yield {"type": "links", "links": cached.links}
+                yield {
+                    "type": "answer",
+                    "answer": cached.answer,
+                    "links": cached.links,
+                    "timings": self._cache_timings(start),
+                }
+                return
+            async for event in self.graph.astream_events(
+                {"input": message},
+                config=config,
+                version="v2"
+            ):
+                if event["event"] == "on_retriever_end" and event["name"] == RETRIEVAL_RUN_NAME:
+                    links = self._links(event["data"]["output"])
+                    yield {"type": "links", "links": links}
+                elif event["event"] == "on_chat_model_stream" and ANSWER_TAG in event.get("tags", []):
+                    token = event["data"]["chunk"].content
+                    if token:
+                        answer.append(token)
+                        yield {"type": "answer_chunk", "answer": token}
+            state = await self.graph.aget_state(config)
+            await asyncio.to_thread(
+                self._store_answer, message, vector, state.values["answer"], links, state.values["context"]
+            )
+            yield {
+                "type": "answer",
+                "answer": "".join(answer),
+                "links": links,
+                "timings": state.values.get("timings", {}),
+            }
+        except Exception as e:
+            logger.error("Error streaming query", exc_info=True)
+            yield {"type": "error", "error": str(e)}
+
+    def _lookup_answer(self, message: str, config: dict) -> tuple:
+        """Find a cached answer for a question that opens a conversation, with the question embedding"""
+        if self.answer_cache is None:
+            return None, None
+        # follow-up questions depend on the earlier turns, only standalone questions are cached
+        if self.graph.get_state(config).values.get("chat_history"):
+            return None, None
+        try:
+            vector = self.embeddings.embed_query(message)
+        except Exception:
+            logger.warning("Could not embed the question for the answer cache", exc_info=True)
+            return None, None
+        cached = self.answer_cache.lookup(vector)
+        if cached is not None:
+            logger.info(f"Answer cache hit for: {message}, cached question: {cached.question}")
+            # keep the conversation going as if the answer had been generated
+            self.graph.update_state(config, {
+                "chat_history": [HumanMessage(message), AIMessage(cached.answer)],
+                "answer": cached.answer,
+                "context": [],
+            }, as_node="memory")
+        return cached, vector
+
+    def _store_answer(self, message: str, vector, answer: str, links: set, context: list) -> None:
+        if self.answer_cache is None or vector is None:
+            return
+        self.answer_cache.store(message, vector, answer, links, {doc.metadata["file_path"] for doc in context})
+
+    @staticmethod
+    def _cache_timings(start: float) -> dict:
+        return {"answer_cache": time.perf_counter() - start}
+
+    def answer_cache_stats(self) -> dict:
+        """Hit rate and size of the semantic answer cache"""
+        if self.answer_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.answer_cache.stats()}
+
+    def end_conversation(self, thread_id: str) -> None:
+        """Release the checkpoints of a finished conversation"""
+        self.checkpointer.delete_thread(thread_id)
+
+
+_shared_chain: Optional[LLMChain] = None
+_shared_chain_lock = threading.Lock()
+
+
+def get_llm_chain() -> LLMChain:
+    """
+    Return the process-wide LLM chain, building it on first use
+
+    The models, clients and compiled graph are shared by every websocket session,
+    per-session state only lives in the graph checkpointer.
+    """
+    global _shared_chain
+    if _shared_chain is None:
+        with _shared_chain_lock:
+            if _shared_chain is None:
+                _shared_chain = LLMChain()
+    return _shared_chain
@@ -1,5 +1,6 @@
-import requests
 import logging
+import numpy as np
+import indexer_client
 from typing import Any, List
 from pydantic import BaseModel
 from langchain_core.embeddings import Embeddings
@@ -7,11 +8,7 @@ from langchain_core.embeddings import Embeddings
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-REQUEST_DATA_URL = "http://indexer:8000/embedding"
-REQUEST_HEADERS = {
-    'Accept': 'application/json',
-    'Content-Type': 'application/json'
-}
+REQUEST_DATA_PATH = "/embedding/batch"
 
 class MinimaEmbeddings(BaseModel, Embeddings):
 
@@ -19,31 +16,85 @@ class MinimaEmbeddings(BaseModel, Embeddings):
         super().__init__(**kwargs)
 
     def embed_documents(self, texts: list[str]) -> list[list[float]]:
-        results = []
-        for text in texts:
-            embedding = self.request_data(text)
-            if "error" in embedding:
-                logger.error(f"Error in embedding: {embedding['error']}")
-            else:
-                embedding = embedding["result"]
-                results.append(embedding)
-        return results
+        embeddings = self.request_data(texts)
+        if "error" in embeddings:
+            logger.error(f"Error in embedding: {embeddings['error']}")
+            return []
+        return embeddings["result"]
 
     def embed_query(self, text: str) -> list[float]:
         return self.embed_documents([text])[0]
 
-    def request_data(self, query):
+    def request_data(self, queries: list[str]):
         payload = {
-            "query": query
+            "queries": queries
         }
-        try:
-            logger.info(f"Requesting data from indexer with query: {query}")
-            response = requests.post(REQUEST_DATA_URL, headers=REQUEST_HEADERS, json=payload)
-            response.raise_for_status()
-            data = response.json()
-            logger.info(f"Received data: {data}")
-            return data
-
-        except requests.exceptions.RequestException as e:
-            logger.error(f"HTTP error: {e}")
-            return {"error": str(e)}
\ No newline at end of file
+        logger.info(f"Requesting {len(queries)} embeddings from indexer")
+        data = indexer_client.post(REQUEST_DATA_PATH, payload)
+        logger.info(f"Received {len(data.get('result', []))} embeddings")
+        return data
+
+
+VERIFICATION_TEXTS = [
+    "What is our VPN policy for remote employees?",
+    "Q3 revenue by region",
+]
+
+
+def create_local_embeddings(model_name: str, device: Any) -> Embeddings:
+    """The indexer's embedding model loaded in-process, with the same encode settings"""
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={'device': device},
+        encode_kwargs={'normalize_embeddings': False},
+    )
+
+
+def max_vector_difference(embeddings: Embeddings, reference: Embeddings, texts: List[str]) -> float | None:
+    """Largest absolute difference between the vectors of two embedding providers, None if the reference failed"""
+    reference_vectors = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    if reference_vectors.size == 0:
+        return None
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    if vectors.shape != reference_vectors.shape:
+        return float("inf")
+    return float(np.abs(vectors - reference_vectors).max())
+
+
+def create_embeddings(
+    provider: str,
+    model_name: str | None = None,
+    device: Any = "cpu",
+    verify: bool = True,
+    tolerance: float = 1e-4,
+) -> Embeddings:
+    """
+    Create the query embeddings for the configured provider
+
+    "http" asks the indexer for every query, "local" runs the same model in-process.
+    A local model is checked against the indexer first and is only used when it
+    produces the same vectors, otherwise queries keep going through the indexer.
+    """
+    if provider == "http":
+        return MinimaEmbeddings()
+    if provider != "local":
+        raise ValueError(f"Unsupported embedding provider: {provider}")
+    if not model_name:
+        raise ValueError("EMBEDDING_MODEL_ID is required for local embeddings")
+    local = create_local_embeddings(model_name, device)
+    if not verify:
+        return local
+    difference = max_vector_difference(local, MinimaEmbeddings(), VERIFICATION_TEXTS)
+    if difference is None:
+        logger.warning("Could not reach the indexer to verify the local embeddings, using them unverified")
+    elif difference > tolerance:
+        logger.error(
+            f"Local embeddings differ from the indexer by {difference}, "
+            f"check EMBEDDING_MODEL_ID, falling back to the indexer"
+        )
+        return MinimaEmbeddings()
+    else:
+        logger.info(f"Local embeddings match the indexer (max difference {difference})")
+    return local
@@ -0,0 +1,34 @@
+import logging
+import indexer_client
+from typing import List
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REQUEST_DATA_PATH = "/documents"
+
+
+class MinimaRetriever(BaseRetriever):
+    """Retrieves chunks through the indexer, used when the indexer keeps vectors in-process"""
+
+    k: int = 4
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        payload = {
+            "query": query,
+            "k": self.k
+        }
+        logger.info(f"Requesting documents from indexer with query: {query}")
+        data = indexer_client.post(REQUEST_DATA_PATH, payload)
+        if "error" in data:
+            logger.error(f"Error in retrieval: {data['error']}")
+            return []
+        return [
+            Document(page_content=doc["page_content"], metadata=doc["metadata"])
+            for doc in data["result"]
+        ]
@@ -0,0 +1,42 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+from langchain_core.messages import BaseMessage
+
+
+class QueryCache:
+    """LRU cache of rewritten retrieval queries, keyed by the rewrite step, the question and the history"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._queries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(step: str, question: str, history: Sequence[BaseMessage]) -> str:
+        normalized_question = " ".join(question.lower().split())
+        turns = "\0".join(f"{message.type}:{message.content}" for message in history)
+        return hashlib.sha256(f"{step}\0{normalized_question}\0{turns}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            query = self._queries.get(key)
+            if query is None:
+                self.misses += 1
+                return None
+            self._queries.move_to_end(key)
+            self.hits += 1
+            return query
+
+    def put(self, key: str, query: str) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._queries[key] = query
+            self._queries.move_to_end(key)
+            while len(self._queries) > self.max_size:
+                self._queries.popitem(last=False)
@@ -0,0 +1,220 @@
+import os
+import queue
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Tuple, Optional
+
+import torch
+from langchain_community.cross_encoders import BaseCrossEncoder
+from langchain_community.cross_encoders.huggingface import HuggingFaceCrossEncoder
+
+logger = logging.getLogger(__name__)
+
+
+class OnnxCrossEncoder(BaseCrossEncoder):
+    """Cross encoder running on ONNX Runtime, optionally with dynamic int8 quantization"""
+
+    def __init__(
+        self,
+        model_name: str,
+        export_dir: str,
+        quantize: bool = False,
+        max_length: int = 512,
+        truncation: str = "only_second",
+        batch_size: int = 16,
+    ):
+        try:
+            from transformers import AutoTokenizer
+            from optimum.onnxruntime import ORTModelForSequenceClassification
+        except ImportError as exc:
+            raise ImportError(
+                "ONNX reranking needs the optimum package. "
+                "Please install it with `pip install optimum[onnxruntime]` "
+                "or build the llm image with RERANKER_BACKEND=onnx."
+            ) from exc
+
+        self.max_length = max_length
+        self.truncation = truncation
+        self.batch_size = batch_size
+        model_dir = os.path.join(export_dir, model_name.replace("/", "--"), "int8" if quantize else "fp32")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        if not os.path.isdir(model_dir):
+            self._export(model_name, model_dir, quantize)
+        self.model = ORTModelForSequenceClassification.from_pretrained(
+            model_dir, file_name="model_quantized.onnx" if quantize else "model.onnx"
+        )
+
+    @staticmethod
+    def _export(model_name: str, model_dir: str, quantize: bool) -> None:
+        from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+        logger.info(f"Exporting reranker {model_name} to ONNX in {model_dir}")
+        model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+        model.save_pretrained(model_dir)
+        if quantize:
+            quantizer = ORTQuantizer.from_pretrained(model)
+            quantizer.quantize(
+                save_dir=model_dir,
+                quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=False),
+            )
+
+    def score(self, text_pairs: List[Tuple[str, str]]) -> List[float]:
+        scores = []
+        for i in range(0, len(text_pairs), self.batch_size):
+            batch = text_pairs[i:i + self.batch_size]
+            features = self.tokenizer(
+                [query for query, _ in batch],
+                [text for _, text in batch],
+                padding=True,
+                truncation=self.truncation,
+                max_length=self.max_length,
+                return_tensors="pt",
+            )
+            logits = self.model(**features).logits
+            # single-label rerankers go through a sigmoid, like sentence-transformers' CrossEncoder
+            if logits.shape[-1] == 1:
+                batch_scores = torch.sigmoid(logits[:, 0])
+            else:
+                batch_scores = torch.softmax(logits, dim=-1)[:, 1]
+            scores.extend(batch_scores.tolist())
+        return scores
+
+
+class TorchCrossEncoder(HuggingFaceCrossEncoder):
+    """sentence-transformers cross encoder that truncates pairs with the configured strategy instead of longest_first"""
+
+    truncation: str = "only_second"
+    batch_size: int = 16
+
+    def score(self, text_pairs: List[Tuple[str, str]]) -> List[float]:
+        client = self.client
+        scores = []
+        with torch.inference_mode():
+            for i in range(0, len(text_pairs), self.batch_size):
+                batch = text_pairs[i:i + self.batch_size]
+                features = client.tokenizer(
+                    [query for query, _ in batch],
+                    [text for _, text in batch],
+                    padding=True,
+                    truncation=self.truncation,
+                    max_length=client.max_length,
+                    return_tensors="pt",
+                ).to(client._target_device)
+                logits = client.default_activation_function(client.model(**features, return_dict=True).logits)
+                # same scores as HuggingFaceCrossEncoder, the only label or the second one
+                batch_scores = logits[:, 0] if logits.shape[-1] == 1 else logits[:, 1]
+                scores.extend(batch_scores.tolist())
+        return scores
+
+
+class CachedCrossEncoder(BaseCrossEncoder):
+    """LRU cache of (query, chunk) scores in front of another cross encoder"""
+
+    def __init__(self, cross_encoder: BaseCrossEncoder, max_size: int):
+        self.cross_encoder = cross_encoder
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._scores: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(query: str, text: str) -> str:
+        normalized_query = " ".join(query.lower().split())
+        return hashlib.sha256(f"{normalized_query}\0{text}".encode("utf-8")).hexdigest()
+
+    def score(self, text_pairs: List[Tuple[str, str]]) -> List[float]:
+        keys = [self._key(query, text) for query, text in text_pairs]
+        scores: dict[str, float] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[key] = self._scores[key]
+        missing = [(key, pair) for key, pair in zip(keys, text_pairs) if key not in scores]
+        if missing:
+            computed = list(self.cross_encoder.score([pair for _, pair in missing]))
+            with self._lock:
+                for (key, _), value in zip(missing, computed):
+                    value = float(value)
+                    scores[key] = value
+                    self._scores[key] = value
+                    self._scores.move_to_end(key)
+                while len(self._scores) > self.max_size:
+                    self._scores.popitem(last=False)
+        with self._lock:
+            self.hits += len(text_pairs) - len(missing)
+            self.misses += len(missing)
+        return [scores[key] for key in keys]
+
+
+class CrossEncoderPool(BaseCrossEncoder):
+    """Bounded pool of cross encoders shared by all chat sessions, a call waits for a free instance"""
+
+    def __init__(self, cross_encoders: List[BaseCrossEncoder]):
+        self.size = len(cross_encoders)
+        self._idle: queue.Queue[BaseCrossEncoder] = queue.Queue()
+        for cross_encoder in cross_encoders:
+            self._idle.put(cross_encoder)
+
+    def score(self, text_pairs: List[Tuple[str, str]]) -> List[float]:
+        cross_encoder = self._idle.get()
+        try:
+            return cross_encoder.score(text_pairs)
+        finally:
+            self._idle.put(cross_encoder)
+
+
+def _load_cross_encoder(
+    model_name: str,
+    device: torch.device,
+    backend: str,
+    quantize: bool,
+    max_length: int,
+    truncation: str,
+    batch_size: int,
+    export_dir: str,
+) -> BaseCrossEncoder:
+    if backend == "onnx":
+        return OnnxCrossEncoder(
+            model_name=model_name,
+            export_dir=export_dir,
+            quantize=quantize,
+            max_length=max_length,
+            truncation=truncation,
+            batch_size=batch_size,
+        )
+    if backend == "torch":
+        return TorchCrossEncoder(
+            model_name=model_name,
+            model_kwargs={'device': device, 'max_length': max_length},
+            truncation=truncation,
+            batch_size=batch_size,
+        )
+    raise ValueError(f"Unsupported reranker backend: {backend}")
+
+
+def create_cross_encoder(
+    model_name: str,
+    device: torch.device,
+    backend: str = "torch",
+    quantize: bool = False,
+    max_length: int = 512,
+    truncation: str = "only_second",
+    batch_size: int = 16,
+    export_dir: str = "/root/.cache/minima/reranker",
+    cache_size: Optional[int] = None,
+    pool_size: int = 1,
+) -> BaseCrossEncoder:
+    """Create the reranking cross encoder for the configured backend"""
+    cross_encoder = CrossEncoderPool([
+        _load_cross_encoder(model_name, device, backend, quantize, max_length, truncation, batch_size, export_dir)
+        for _ in range(max(pool_size, 1))
+    ])
+    logger.info(f"Loaded {cross_encoder.size} {backend} reranker instance(s) of {model_name}")
+    if cache_size:
+        return CachedCrossEncoder(cross_encoder, cache_size)
+    return cross_encoder
@@ -0,0 +1,60 @@
+from typing import Annotated, Sequence, TypedDict
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langgraph.graph import START, StateGraph
+from langgraph.graph.message import add_messages
+
+from checkpointer import BoundedMemorySaver
+
+
+class State(TypedDict):
+    input: str
+    answer: str
+    chat_history: Annotated[Sequence[BaseMessage], add_messages]
+
+
+def answer(state: State) -> dict:
+    reply = f"answer {len(state['chat_history']) // 2 + 1} to {state['input']}"
+    return {
+        "answer": reply,
+        "chat_history": [HumanMessage(state["input"]), AIMessage(reply)],
+    }
+
+
+def create_graph(checkpointer: BoundedMemorySaver):
+    workflow = StateGraph(state_schema=State)
+    workflow.add_node("respond", answer)
+    workflow.add_edge(START, "respond")
+    return workflow.compile(checkpointer=checkpointer)
+
+
+def test_pruned_thread_resumes_with_full_history():
+    checkpointer = BoundedMemorySaver()
+    graph = create_graph(checkpointer)
+    config = {"configurable": {"thread_id": "conversation"}}
+
+    graph.invoke({"input": "first"}, config=config)
+    graph.invoke({"input": "second"}, config=config)
+
+    # only the latest checkpoint and the newest value of each channel are left
+    assert len(checkpointer.storage["conversation"][""]) == 1
+    channels = [key[2] for key in checkpointer.blobs if key[0] == "conversation"]
+    assert len(channels) == len(set(channels))
+
+    resumed = create_graph(checkpointer).invoke({"input": "third"}, config=config)
+    assert resumed["answer"] == "answer 3 to third"
+    assert [message.content for message in resumed["chat_history"]] == [
+        "first", "answer 1 to first", "second", "answer 2 to second", "third", "answer 3 to third",
+    ]
+
+
+def test_delete_thread_forgets_the_conversation():
+    checkpointer = BoundedMemorySaver()
+    graph = create_graph(checkpointer)
+    config = {"configurable": {"thread_id": "conversation"}}
+    graph.invoke({"input": "first"}, config=config)
+
+    checkpointer.delete_thread("conversation")
+
+    assert checkpointer.get_tuple(config) is None
+    assert graph.invoke({"input": "again"}, config=config)["answer"] == "answer 1 to again"
@@ -2,7 +2,7 @@ import logging
 import mcp.server.stdio
 from typing import Annotated
 from mcp.server import Server
-from .requestor import request_data
+from .requestor import request_data, close_client
 from pydantic import BaseModel, Field
 from mcp.server.stdio import stdio_server
 from mcp.shared.exceptions import McpError
@@ -44,6 +44,10 @@ class Query(BaseModel):
         str | None, 
         Field(description="Loại tệp cần tìm kiếm")
     ] = None
+    folder: Annotated[
+        str | None,
+        Field(description="Thư mục cần tìm kiếm")
+    ] = None
     format: Annotated[
         str | None, 
         Field(description="Định dạng kết quả mong muốn")
@@ -112,6 +116,9 @@ async def call_tool(name, arguments: dict) -> list[TextContent]:
     except ValueError as e:
         logging.error(str(e))
         raise McpError(INVALID_PARAMS, str(e))
+    if args.max_results is not None and args.max_results < 1:
+        logging.error(f"Invalid max_results: {args.max_results}")
+        raise McpError(INVALID_PARAMS, "max_results must be a positive integer")
         
     context = args.text
     logging.info(f"Context: {context}")
@@ -129,7 +136,7 @@ async def call_tool(name, arguments: dict) -> list[TextContent]:
     if additional_params:
         logging.info(f"Additional parameters for tool call: {additional_params}")
 
-    output = await request_data(context)
+    output = await request_data(context, k=args.max_results, file_type=args.file_type, folder=args.folder)
     if "error" in output:
         logging.error(output["error"])
         raise McpError(INTERNAL_ERROR, output["error"])
@@ -174,7 +181,19 @@ async def get_prompt(name: str, arguments: dict | None) -> GetPromptResult:
     if additional_params:
         logging.info(f"Additional parameters: {additional_params}")
 
-    output = await request_data(context)
+    max_results = additional_params.get("max_results")
+    try:
+        k = int(max_results) if max_results else None
+    except (TypeError, ValueError):
+        k = 0
+    if k is not None and k < 1:
+        logging.error(f"Invalid max_results: {max_results}")
+        raise McpError(INVALID_PARAMS, "max_results must be a positive integer")
+    output = await request_data(
+        context,
+        k=k,
+        file_type=additional_params.get("file_type")
+    )
     if "error" in output:
         error = output["error"]
         logging.error(error)
@@ -208,15 +227,18 @@ async def get_prompt(name: str, arguments: dict | None) -> GetPromptResult:
 
 async def main():
     async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
-        await server.run(
-            read_stream,
-            write_stream,
-            InitializationOptions(
-                server_name="mslocalrag",
-                server_version="0.0.1",
-                capabilities=server.get_capabilities(
-                    notification_options=NotificationOptions(),
-                    experimental_capabilities={},
+        try:
+            await server.run(
+                read_stream,
+                write_stream,
+                InitializationOptions(
+                    server_name="mslocalrag",
+                    server_version="0.0.1",
+                    capabilities=server.get_capabilities(
+                        notification_options=NotificationOptions(),
+                        experimental_capabilities={},
+                    ),
                 ),
-            ),
-        )
+            )
+        finally:
+            await close_client()